@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # Minimal device agent: collect system/network metrics and POST them to the server.
-import argparse, json, socket, subprocess, time, urllib.request, urllib.error
+import argparse, gzip, json, socket, struct, subprocess, time, urllib.request, urllib.error
 
 def sh(cmd_list):
     # Run a command and return stdout (string)
@@ -115,9 +115,46 @@ def device_id(prefer=None):
 
 # -------- http --------
 
-def post_json(url, payload, timeout=5.0):
-    data = json.dumps(payload).encode()
-    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+# Binary payload v1, decoded by server/wire.py. encode_binary() must produce the
+# same bytes as wire.encode() there; server/tests/test_wire.py checks that.
+# "IM", version u8, presence flags u16 (bit i set when the i-th number was sent),
+# ts i64, interval u32, 7 × f64, 4 × u64, then device_id/iface/ip/mac as u8 length
+# + UTF-8 bytes (cut to 255 bytes on a character boundary).
+WIRE_CONTENT_TYPE = "application/x-iot-metrics"
+WIRE_HEADER = struct.Struct("<2sBHqI7d4Q")
+
+def wire_text(text):
+    b = str(text or "").encode()
+    if len(b) > 255:
+        b = b[:255].decode(errors="ignore").encode()
+    return bytes((len(b),)) + b
+
+def encode_binary(payload):
+    s, n = payload.get("system", {}), payload.get("network", {})
+    load = (list(s.get("loadavg") or []) + [None] * 3)[:3]
+    raw = [s.get("uptime_s"), s.get("cpu_pct"), s.get("mem_pct"), s.get("disk_pct"), *load,
+           n.get("rx_bytes"), n.get("tx_bytes"), n.get("rx_packets"), n.get("tx_packets")]
+    flags = 0
+    for i, v in enumerate(raw):
+        if v is not None:
+            flags |= 1 << i
+    nums = [float(v or 0) for v in raw[:7]] + [int(v or 0) for v in raw[7:]]
+    out = [WIRE_HEADER.pack(b"IM", 1, flags, int(payload["ts"]), int(payload.get("interval", 0)), *nums)]
+    for text in (payload["device_id"], n.get("iface"), n.get("ip"), n.get("mac")):
+        out.append(wire_text(text))
+    return b"".join(out)
+
+def post_sample(url, payload, timeout=5.0, compress=False, binary=False):
+    if binary:
+        data, ctype = encode_binary(payload), WIRE_CONTENT_TYPE
+    else:
+        data, ctype = json.dumps(payload, separators=(",", ":")).encode(), "application/json"
+    headers = {"Content-Type": ctype}
+    if compress:
+        # Server inflates gzip bodies; worth it on metered links
+        data = gzip.compress(data)
+        headers["Content-Encoding"] = "gzip"
+    req = urllib.request.Request(url, data=data, headers=headers)
     with urllib.request.urlopen(req, timeout=timeout) as r:
         return r.read().decode()
 
@@ -152,6 +189,8 @@ def main():
     ap.add_argument("--server", default="http://localhost:8000")
     ap.add_argument("--interval", type=int, default=10)
     ap.add_argument("--device-id", default=None)
+    ap.add_argument("--compress", action="store_true", help="gzip request bodies")
+    ap.add_argument("--format", choices=("json", "binary"), default="json", help="payload encoding")
     a = ap.parse_args()
 
     url = a.server.rstrip("/") + "/metrics"
@@ -162,7 +201,7 @@ def main():
     while True:
         payload = collect(dev, interval)
         try:
-            post_json(url, payload)
+            post_sample(url, payload, compress=a.compress, binary=a.format == "binary")
             print(f"[agent] sent ts={payload['ts']} cpu={payload['system']['cpu_pct']} mem={payload['system']['mem_pct']}")
             time.sleep(interval)
         except (urllib.error.HTTPError, urllib.error.URLError) as e:
@@ -171,7 +210,7 @@ def main():
             for back in (2, 4, 8):
                 time.sleep(back)
                 try:
-                    post_json(url, payload)
+                    post_sample(url, payload, compress=a.compress, binary=a.format == "binary")
                     print(f"[agent] retry ok after {back}s")
                     break
                 except Exception:
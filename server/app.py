@@ -1,16 +1,113 @@
-from flask import Flask, request, jsonify, render_template
-import time
+from flask import Flask, Response, request, jsonify, render_template
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from functools import lru_cache, wraps
+import gc, gzip, heapq, json, os, threading, time, zlib
+
+import checkpoint
+from history import HISTORY_FIELDS, drop_missing, resample
+from ingest_queue import IngestQueue
+from rollup import ROLLUP_FIELDS, parse_tiers
+import schema
+from singleflight import SingleFlight
+from snapshot import Snapshot, SnapshotPublisher
+from sortedlist import SortedList
+import query
+import rates
+from sketch import FleetQuantiles
+from state import DeviceState
+from store import DeviceStore
+from summary import FleetSummary, parse_thresholds
+from stream import Broadcaster
+from timerwheel import TimerWheel
+from wal import WriteAheadLog
+import wire
 
 app = Flask(__name__)
 
-# Latest device state kept in memory: {device_id: {"metrics": {}, "last_seen": int, "interval": int}}
-DEVICES = {}
+# Device ids in sorted order, maintained on first sight; also answers prefix searches
+DEVICE_INDEX = SortedList()
+# (value, device_id) indexes on every numeric field: back sort=, range filters and top-k
+INDEXED_COLUMNS = (
+    "last_seen", "uptime_s", "cpu_pct", "mem_pct", "disk_pct",
+    "loadavg_1", "loadavg_5", "loadavg_15",
+    "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+) + rates.RATE_FIELDS
+SORT_INDEXES = {col: SortedList() for col in INDEXED_COLUMNS}
+PAGE_LIMIT_MAX = 1000  # rows per /devices page (and k for /devices/top)
+HISTORY_POINTS_MAX = 10000  # resampled points per /devices/<id>/history response
+HISTORY_POINTS_DEFAULT = 300  # target points when no step is given
+# Change tracking for incremental reads: every device update and every online/offline
+# flip takes the next VERSION. BOOT_ID tells clients when versions restarted.
+VERSION = 0
+BOOT_ID = int(time.time() * 1000)
+CHANGES = OrderedDict()  # device_id -> version of its latest change, oldest change first
+STATUS = {}              # device_id -> online flag as last published
+STATUS_CHANGED = {}      # device_id -> version of its latest online/offline flip
+STATUS_EPOCH = 0         # bumped on every online/offline flip
+ONLINE_COUNT = 0         # devices currently online, kept in step with STATUS
+# Aggregates over online devices, caught up from the change log by sync_derived()
+SUMMARY_THRESHOLDS = parse_thresholds(os.environ.get("SUMMARY_THRESHOLDS", "cpu_pct:90,mem_pct:90,disk_pct:90"))
+SUMMARY = FleetSummary(("cpu_pct", "mem_pct", "disk_pct"), SUMMARY_THRESHOLDS)
+# Devices are grouped by their id up to the last separator: "site-12-0042" -> "site-12"
+DEVICE_GROUP_SEP = os.environ.get("DEVICE_GROUP_SEP", "-")
+
+def group_of(device_id: str) -> str:
+    return device_id.rpartition(DEVICE_GROUP_SEP)[0]
+
+# Streaming quantile sketches over online devices, fleet-wide and per group
+QUANTILE_FIELDS = ("cpu_pct", "mem_pct", "disk_pct", "loadavg_1", "loadavg_5", "loadavg_15",
+                   "rx_bytes", "tx_bytes", "rx_packets", "tx_packets") + rates.RATE_FIELDS
+QUANTILES = FleetQuantiles(QUANTILE_FIELDS, group_of)
+# Fires online -> offline at each device's last_seen + 2 × interval; re-armed on ingest
+EXPIRY = TimerWheel(int(time.time()))
+# Recent numeric samples per device are kept in fixed-size typed ring buffers
+HISTORY_CAPACITY = int(os.environ.get("HISTORY_CAPACITY", "360"))  # samples kept per device
+# Per-device min/max/avg/last/count rollups of rollup.ROLLUP_FIELDS as "step:retention"
+# pairs in seconds; defaults keep 5m for 1d and 1h for 7d (456 buckets, ~135 KB a device)
+ROLLUP_TIERS = parse_tiers(os.environ.get("ROLLUP_TIERS", "300:86400,3600:604800"))
+# Latest state, history and rollups per device, sharded into lock stripes by device id
+STORE = DeviceStore(int(os.environ.get("STORE_STRIPES", "64")), HISTORY_CAPACITY, ROLLUP_TIERS)
 REPORT_INTERVAL_DEFAULT = 10  # seconds
+# JSON payload -> DeviceState, and the same checks for binary-decoded states,
+# compiled once from the declarative schema
+parse_record = schema.compile_payload(schema.PAYLOAD, REPORT_INTERVAL_DEFAULT)
+check_state = schema.compile_state_check(schema.PAYLOAD)
+BATCH_MAX_RECORDS = 5000  # upper bound on records per /metrics/batch request
+DEVICES_CACHE_MAX_AGE = int(os.environ.get("DEVICES_CACHE_MAX_AGE", "30"))  # seconds a read snapshot may serve an idle fleet
+SNAPSHOT_INTERVAL_MS = int(os.environ.get("SNAPSHOT_INTERVAL_MS", "250"))  # minimum gap between read snapshots while writes arrive
+SSE_TICK = float(os.environ.get("SSE_TICK", "1.0"))  # seconds between coalesced /devices/stream flushes
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", str(16 << 20)))  # cap on decompressed request bodies
+
+# Optional on-disk write-ahead log; state is rebuilt from it on startup when WAL_DIR is set
+WAL_DIR = os.environ.get("WAL_DIR")
+
+def open_wal(directory: str) -> WriteAheadLog:
+    return WriteAheadLog(
+        directory,
+        segment_bytes=int(os.environ.get("WAL_SEGMENT_MB", "64")) << 20,
+        fsync_interval=float(os.environ.get("WAL_FSYNC_INTERVAL", "1.0")),
+        retention=int(os.environ.get("WAL_RETENTION", "86400")),
+    )
+
+WAL = open_wal(WAL_DIR) if WAL_DIR else None
+# With a WAL, the store is also checkpointed to WAL_DIR every CHECKPOINT_INTERVAL seconds
+# (0 disables); recovery then replays only the log written since the checkpoint began,
+# starting CHECKPOINT_MARGIN seconds earlier to cover samples still in flight then
+CHECKPOINT_INTERVAL = int(os.environ.get("CHECKPOINT_INTERVAL", "300"))
+CHECKPOINT_MARGIN = 60
+CHECKPOINTING = True  # whether this process writes them (one worker in prefork mode)
+# Shared-memory device table when running as one of several pre-forked workers (serve.py)
+SHARED = None
 
 def mark_online_state(now: int, last_seen: int, interval: int) -> bool:
     # Consider a device online if it reported within ~2× its configured interval
     return (now - last_seen) <= (2 * max(interval, REPORT_INTERVAL_DEFAULT))
 
+def offline_at(last_seen: int, interval: int) -> int:
+    # First second at which mark_online_state() turns False
+    return last_seen + 2 * max(interval, REPORT_INTERVAL_DEFAULT) + 1
+
 def human_ago(seconds: int) -> str:
     # Compact "x ago" string for the UI
     if seconds < 60:
@@ -24,73 +121,1089 @@ def human_ago(seconds: int) -> str:
     days = hrs // 24
     return f"{days}d ago"
 
+def parse_payload(payload) -> DeviceState:
+    # Validate and coerce one agent payload against schema.PAYLOAD; raises ValueError on bad input
+    if isinstance(payload, DeviceState):
+        return claim_slot(check_state(payload))  # binary records are decoded straight into state
+    return claim_slot(parse_record(payload))
+
+def claim_slot(state: DeviceState) -> DeviceState:
+    # In prefork mode, reject a device the shared table has no room for up front
+    if SHARED is not None:
+        SHARED.slot_for(state.device_id)
+    return state
+
+def touch(device_id: str, version: int = None) -> int:
+    # Record a change to one device and return its new version (caller holds APPLY_LOCK);
+    # prefork workers pass the version the shared table gave the change
+    global VERSION
+    VERSION = VERSION + 1 if version is None else version
+    CHANGES[device_id] = VERSION
+    CHANGES.move_to_end(device_id)
+    return VERSION
+
+def set_status(device_id: str, online: bool, version: int):
+    # Publish an online/offline flip at `version`
+    global STATUS_EPOCH, ONLINE_COUNT
+    was = STATUS.get(device_id)
+    if was != online:
+        STATUS_EPOCH += 1
+        ONLINE_COUNT += (1 if online else 0) - (1 if was else 0)
+        STATUS[device_id] = online
+        STATUS_CHANGED[device_id] = version
+
+def apply_state(state: DeviceState, version: int = None, online: bool = None):
+    # Store the latest state for a validated payload and fold it into history and
+    # rollups. A sample no newer than the stored one (late, or resent) is dropped,
+    # as recovery drops it. Per-device work runs under the device's stripe lock only;
+    # APPLY_LOCK is held just for the version, change log and status.
+    stripe = STORE.stripe(state.device_id)
+    with stripe.lock:
+        prev = stripe.states.get(state.device_id)
+        if prev is not None and state.last_seen <= prev.last_seen:
+            return
+        if SHARED is None:
+            # (prefork workers get rates from the shared table, derived by the publisher,
+            # and build row fragments only when a row is first served)
+            (state.rx_bytes_ps, state.tx_bytes_ps,
+             state.rx_packets_ps, state.tx_packets_ps) = rates.sample_rates(prev, state)
+            state.fragment = row_fragment(state)
+        with APPLY_LOCK:
+            publish_state(stripe, state, prev, version, online)
+        STORE.append_sample(stripe, state)
+
+def publish_state(stripe, state: DeviceState, prev, version: int = None, online: bool = None):
+    # Swap in the new state and update the change log, expiry and status (caller holds
+    # the stripe lock and APPLY_LOCK). Sort indexes and aggregates follow lazily, see
+    # sync_derived(). `online` comes from the shared table in prefork mode.
+    state.version = touch(state.device_id, version)
+    if prev is None:
+        DEVICE_INDEX.add(state.device_id)
+    stripe.states[state.device_id] = state
+    if online is None:
+        online = mark_online_state(int(time.time()), state.last_seen, state.interval)
+    if online:
+        EXPIRY.arm(state.device_id, offline_at(state.last_seen, state.interval))
+    else:
+        EXPIRY.cancel(state.device_id)
+    set_status(state.device_id, online, state.version)
+
+def apply_shared(version: int, online: bool, state: DeviceState):
+    # One change from the shared table: a new sample, or an expiry of the sample
+    # this worker already holds (same last_seen), which only flips the status
+    prev = STORE.get(state.device_id)
+    if prev is None or prev.last_seen != state.last_seen:
+        apply_state(state, version, online)
+        return
+    with APPLY_LOCK:
+        touch(state.device_id, version)
+        if online:
+            EXPIRY.arm(state.device_id, offline_at(state.last_seen, state.interval))
+        else:
+            EXPIRY.cancel(state.device_id)
+        set_status(state.device_id, online, version)
+
+# Guards the fleet-wide structures: versions and change log, id and sort indexes,
+# summaries, expiry wheel and status. Held briefly by writers (after their per-device
+# work) and by readers taking a snapshot; never while serializing a response.
+#
+# Lock order: SYNC_LOCK -> a stripe lock (at most one) -> APPLY_LOCK. Nothing that
+# holds APPLY_LOCK may take a stripe lock, so no STORE.values() or
+# STORE.read_history() under it; STORE.get() is a plain dict read and is fine.
+APPLY_LOCK = threading.Lock()
+# Keeps shared-table changes applied one batch at a time, in ring order (prefork mode)
+SYNC_LOCK = threading.Lock()
+
+# Sort indexes, the fleet summary and the quantile sketches are views over the latest
+# states and STATUS. Instead of being updated on every sample they are caught up from
+# the change log when a read needs them, so a device that reported ten times since
+# costs one update, and a prefork worker nobody asks for sorted pages or fleet
+# aggregates does none of this work. While they are being read (within DERIVED_WARM
+# seconds) the expiry tick also catches them up each second, so a read only pays
+# for the last second of changes. When most of the fleet changed since (a cold
+# start, or no reads for a while) prepare_derived() rebuilds them without holding
+# APPLY_LOCK, so writers are not held up for the length of a rebuild.
+DERIVED_WARM = 60.0
+_indexed = {}          # device_id -> state whose values are in SORT_INDEXES
+_aggregated = {}       # device_id -> state counted in SUMMARY and QUANTILES (online ones)
+_derived_version = 0   # VERSION the derived structures reflect
+_derived_read = 0.0    # monotonic time of the last read that needed them
+REBUILD_LOCK = threading.Lock()  # one rebuild at a time
+
+def changed_ids(since: int, limit: int = None) -> list:
+    # Devices changed after `since`, newest change first, at most `limit` of them
+    # (caller holds APPLY_LOCK)
+    ids = []
+    for device_id in reversed(CHANGES):
+        if CHANGES[device_id] <= since or len(ids) == limit:
+            break
+        ids.append(device_id)
+    return ids
+
+def catch_up(ids, indexes: dict, summary, quantiles, indexed: dict, aggregated: dict):
+    # Bring one set of derived structures up to date for the devices in `ids`; the two
+    # dicts record which state each device has in the indexes and in the aggregates
+    for device_id in ids:
+        st = STORE.get(device_id)
+        old = indexed.get(device_id)
+        if old is not st:
+            for col, index in indexes.items():
+                key = query.index_key(getattr(st, col))
+                if old is not None:
+                    old_key = query.index_key(getattr(old, col))
+                    if old_key == key:
+                        continue
+                    index.remove((old_key, device_id))
+                index.add((key, device_id))
+            indexed[device_id] = st
+        counted = aggregated.pop(device_id, None)
+        if counted is not None:
+            summary.remove(counted)
+            quantiles.remove(counted)
+        if STATUS.get(device_id):
+            summary.add(st)
+            quantiles.add(st)
+            aggregated[device_id] = st
+
+REBUILD_SWAP = 1000  # changes left to catch up under APPLY_LOCK when swapping in a rebuild
+
+def prepare_derived():
+    # Rebuild the derived structures from scratch when that is cheaper than catching
+    # up one device at a time, i.e. when more than half the fleet changed since.
+    # Called without APPLY_LOCK, before the sync_derived() a read does under it. The
+    # new structures are built from a list of the states and caught up on the changes
+    # made meanwhile, all outside the lock, which is taken only to list those changes
+    # and, once few are left, to apply the rest and swap the structures in. Should
+    # writers change devices faster than the catch-up gets through them, the rest is
+    # applied under the lock instead of chasing them.
+    global SUMMARY, QUANTILES, _derived_version
+    half = len(_indexed) // 2
+    if VERSION - _derived_version <= half:
+        return  # fewer versions than that, so fewer changed devices
+    with REBUILD_LOCK:
+        with APPLY_LOCK:
+            since = VERSION
+            if len(changed_ids(_derived_version, half + 1)) <= half:
+                return
+        gc.disable()  # the allocations below would set off full collections, pausing writers
+        try:
+            states = STORE.values()
+            indexes = {col: SortedList((query.index_key(getattr(st, col)), st.device_id) for st in states)
+                       for col in INDEXED_COLUMNS}
+            summary = FleetSummary(SUMMARY.fields, SUMMARY_THRESHOLDS)
+            quantiles = FleetQuantiles(QUANTILE_FIELDS, group_of)
+            indexed, aggregated = {}, {}
+            for st in states:
+                indexed[st.device_id] = st
+                if STATUS.get(st.device_id):
+                    summary.add(st)
+                    quantiles.add(st)
+                    aggregated[st.device_id] = st
+            backlog = None
+            while True:
+                with APPLY_LOCK:
+                    ids, version = changed_ids(since), VERSION
+                    if len(ids) <= REBUILD_SWAP or (backlog is not None and len(ids) > backlog // 2):
+                        catch_up(ids, indexes, summary, quantiles, indexed, aggregated)
+                        SORT_INDEXES.update(indexes)
+                        SUMMARY, QUANTILES = summary, quantiles
+                        _indexed.clear()
+                        _indexed.update(indexed)
+                        _aggregated.clear()
+                        _aggregated.update(aggregated)
+                        _derived_version = version
+                        break
+                catch_up(ids, indexes, summary, quantiles, indexed, aggregated)
+                backlog, since = len(ids), version
+        finally:
+            gc.enable()
+
+def sync_derived(reading: bool = True):
+    # Bring SORT_INDEXES, SUMMARY and QUANTILES up to VERSION (caller holds APPLY_LOCK,
+    # after prepare_derived())
+    global _derived_version, _derived_read
+    if reading:
+        _derived_read = time.monotonic()
+    if _derived_version != VERSION:
+        catch_up(changed_ids(_derived_version), SORT_INDEXES, SUMMARY, QUANTILES, _indexed, _aggregated)
+        _derived_version = VERSION
+
+def ingest(states):
+    # Log validated states (group-committed), then apply them in order. In prefork
+    # mode they only go to the shared table; every worker applies them from there
+    # before its next read.
+    if WAL is not None:
+        WAL.append(st.to_record() for st in states)
+    if SHARED is not None:
+        now = int(time.time())
+        SHARED.publish(states, lambda st: mark_online_state(now, st.last_seen, st.interval))
+        return
+    for st in states:
+        apply_state(st)
+
+def sync_shared():
+    # Apply whatever other workers published since this worker last looked
+    if SHARED is None:
+        return
+    with SYNC_LOCK:
+        for version, online, st in SHARED.changes():
+            apply_shared(version, online, st)
+
+def ingest_records(records):
+    # Queue worker: validate decoded payloads and apply the good ones as one batch;
+    # returns the number dropped as invalid
+    valid = []
+    for rec in records:
+        try:
+            valid.append(parse_payload(rec))
+        except ValueError as e:
+            print(f"[server] dropped queued record: {e}")
+    if valid:
+        ingest(valid)
+    return len(records) - len(valid)
+
+# "sync" applies records on the request thread; "async" only decodes, enqueues and returns 202
+INGEST_MODE = os.environ.get("INGEST_MODE", "sync")
+INGEST_QUEUE = IngestQueue(
+    ingest_records,
+    depth=int(os.environ.get("INGEST_QUEUE_DEPTH", "10000")),
+    workers=int(os.environ.get("INGEST_WORKERS", "1")),
+    batch_size=int(os.environ.get("INGEST_BATCH", "500")),
+) if INGEST_MODE == "async" else None
+
+def enqueue(records):
+    # 202 once queued, 503 with Retry-After when the queue is full, 413 for more
+    # records than the queue can ever hold
+    if len(records) > INGEST_QUEUE.depth:
+        return jsonify({"error": f"batch too large for the ingest queue (max {INGEST_QUEUE.depth} records)"}), 413
+    if not INGEST_QUEUE.offer(records):
+        resp = jsonify({"error": "ingest queue full"})
+        resp.headers["Retry-After"] = "1"
+        return resp, 503
+    return None
+
+RECOVERY_REORDER_WINDOW = 65536  # samples held back to restore time order across worker logs
+RECOVERY_CHUNK = 100000  # replayed samples folded into history and rollups per device at once
+
+def reorder(states, window: int):
+    # Time-ordered stream from a nearly time-ordered one, holding `window` samples in a heap
+    heap = []
+    for i, st in enumerate(states):
+        heapq.heappush(heap, (st.last_seen, i, st))
+        if len(heap) > window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+def recover_from_wal():
+    # Rebuild in-memory state from the latest checkpoint plus the log written since
+    # (the whole log without one). Prefork workers log to worker-<n>/ subdirectories;
+    # their logs are merged by sample time. Each is only roughly time-ordered, so the
+    # merge goes through a bounded reorder buffer, and a sample no newer than what
+    # its device holds is skipped. Replayed samples only touch their own device: its
+    # latest state at once, its history and rollups a chunk of samples at a time.
+    # The fleet-wide structures are built once at the end.
+    started = time.time()
+    n = 0
+    since = 0.0
+    loaded = checkpoint.read(WAL_DIR, checkpoint.layout(HISTORY_CAPACITY, ROLLUP_TIERS))
+    if loaded is not None:
+        taken, devices = loaded
+        for st, hist, rollups in devices:
+            stripe = STORE.stripe(st.device_id)
+            stripe.states[st.device_id] = st
+            stripe.history[st.device_id] = hist
+            stripe.rollups[st.device_id] = rollups
+        since = taken - CHECKPOINT_MARGIN
+        print(f"[server] loaded checkpoint of {len(devices)} devices in {time.time() - started:.2f}s")
+    logs = [WAL] + [open_wal(os.path.join(WAL_DIR, d)) for d in sorted(os.listdir(WAL_DIR))
+                    if d.startswith("worker-") and os.path.isdir(os.path.join(WAL_DIR, d))]
+    pending = {}  # device_id -> replayed samples not yet in its history and rollups
+    merged = heapq.merge(*(map(DeviceState.from_record, log.replay(since)) for log in logs),
+                         key=lambda st: st.last_seen)
+    if len(logs) > 1:
+        merged = reorder(merged, RECOVERY_REORDER_WINDOW)
+    for st in merged:
+        stripe = STORE.stripe(st.device_id)
+        prev = stripe.states.get(st.device_id)
+        if prev is not None and st.last_seen <= prev.last_seen:
+            continue
+        (st.rx_bytes_ps, st.tx_bytes_ps,
+         st.rx_packets_ps, st.tx_packets_ps) = rates.sample_rates(prev, st)
+        stripe.states[st.device_id] = st
+        pending.setdefault(st.device_id, []).append(st)
+        n += 1
+        if n % RECOVERY_CHUNK == 0:
+            fold_recovered(pending)
+    fold_recovered(pending)
+    index_recovered()
+    print(f"[server] recovered {n} samples for {len(STORE)} devices from WAL in {time.time() - started:.2f}s")
+
+def fold_recovered(pending: dict):
+    # Bulk-append each device's replayed samples to its history and rollups
+    for device_id, states in pending.items():
+        stripe = STORE.stripe(device_id)
+        with stripe.lock:
+            STORE.extend_samples(stripe, device_id, [st.last_seen for st in states],
+                                 [st.sample() for st in states])
+    pending.clear()
+
+def index_recovered():
+    # Fleet-wide structures over the recovered latest states, built in one pass:
+    # id index, change log (in sample order), status and expiry. Row fragments,
+    # sort indexes and aggregates follow on first read.
+    global DEVICE_INDEX
+    now = int(time.time())
+    states = sorted(STORE.values(), key=lambda st: st.last_seen)
+    with APPLY_LOCK:
+        DEVICE_INDEX = SortedList(st.device_id for st in states)
+        for st in states:
+            st.version = touch(st.device_id)
+            online = mark_online_state(now, st.last_seen, st.interval)
+            if online:
+                EXPIRY.arm(st.device_id, offline_at(st.last_seen, st.interval))
+            set_status(st.device_id, online, st.version)
+
+def write_checkpoint():
+    # Checkpoint the store one stripe at a time; each stripe's devices are encoded
+    # under its lock and written after it is released
+    started = time.time()
+    sync_shared()
+
+    def entries():
+        for stripe in STORE.stripes:
+            with stripe.lock:
+                chunk = [checkpoint.encode_device(st, stripe.history[d], stripe.rollups[d])
+                         for d, st in stripe.states.items()]
+            yield from chunk
+
+    n = checkpoint.write(WAL_DIR, started, checkpoint.layout(HISTORY_CAPACITY, ROLLUP_TIERS), entries())
+    print(f"[server] checkpoint of {n} devices written in {time.time() - started:.2f}s")
+
+def _checkpoint_loop():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL)
+        try:
+            write_checkpoint()
+        except OSError as e:
+            print(f"[server] checkpoint failed: {e}")
+
+class BodyError(Exception):
+    # Request body that cannot be read; carries the HTTP status to answer with
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+def read_body() -> bytes:
+    # Raw request body, inflated according to Content-Encoding (gzip/deflate).
+    # Inflation stops at MAX_BODY_BYTES so a small compressed body cannot expand unbounded.
+    data = request.get_data()
+    enc = (request.headers.get("Content-Encoding") or "identity").strip().lower()
+    if enc == "identity":
+        return data
+    if enc in ("gzip", "x-gzip"):
+        wbits = 16 + zlib.MAX_WBITS
+    elif enc == "deflate":
+        # RFC says zlib-wrapped, some clients send raw deflate
+        wbits = zlib.MAX_WBITS if data[:1] == b"\x78" else -zlib.MAX_WBITS
+    else:
+        raise BodyError(f"unsupported Content-Encoding: {enc}", 415)
+    d = zlib.decompressobj(wbits)
+    try:
+        out = d.decompress(data, MAX_BODY_BYTES + 1)
+    except zlib.error:
+        raise BodyError(f"invalid {enc} body", 400)
+    if len(out) > MAX_BODY_BYTES or d.unconsumed_tail:
+        raise BodyError(f"decompressed body exceeds {MAX_BODY_BYTES} bytes", 413)
+    return out
+
+def decode_batch(body: bytes, ndjson: bool) -> list:
+    # Split a batch body into records: a JSON array, or one JSON object per line.
+    # Lines that fail to decode are kept as exceptions so they get their own status.
+    if not ndjson:
+        try:
+            doc = json.loads(body)
+        except ValueError:
+            doc = None
+        if isinstance(doc, list):
+            return doc
+        if isinstance(doc, dict):
+            return [doc]
+    records = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records.append(ValueError("invalid JSON"))
+    return records
+
 @app.route("/metrics", methods=["POST"])
 def metrics():
-    # Ingest metrics from agents (JSON)
+    # Ingest metrics from agents (JSON or binary, optionally gzip/deflate encoded)
     try:
-        payload = request.get_json(force=True, silent=False)
-    except Exception:
-        return jsonify({"error": "invalid JSON"}), 400
+        body = read_body()
+    except BodyError as e:
+        return jsonify({"error": str(e)}), e.status
+    if request.mimetype == wire.CONTENT_TYPE:
+        states, err = wire.decode(body, REPORT_INTERVAL_DEFAULT)
+        if err or len(states) != 1:
+            return jsonify({"error": err or "expected exactly one record"}), 400
+        payload = states[0]
+    else:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return jsonify({"error": "invalid JSON"}), 400
 
-    # Minimal schema check
-    for k in ("device_id", "ts", "system", "network"):
-        if k not in payload:
-            return jsonify({"error": f"missing field: {k}"}), 400
+    if INGEST_QUEUE is not None:
+        return enqueue([payload]) or (jsonify({"status": "queued"}), 202)
 
-    device_id = str(payload["device_id"])
-    ts = int(payload["ts"])
-    interval = int(payload.get("interval", REPORT_INTERVAL_DEFAULT))
+    try:
+        state = parse_payload(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    DEVICES[device_id] = {"metrics": payload, "last_seen": ts, "interval": interval}
+    ingest((state,))
     return jsonify({"status": "ok"})
 
-def build_rows():
-    # Flatten stored metrics for the dashboard and JSON endpoint
+@app.route("/metrics/batch", methods=["POST"])
+def metrics_batch():
+    # Ingest many payloads per request (JSON array, NDJSON or concatenated binary records),
+    # one status per record
+    ndjson = request.mimetype in ("application/x-ndjson", "application/jsonl")
+    try:
+        body = read_body()
+    except BodyError as e:
+        return jsonify({"error": str(e)}), e.status
+    if request.mimetype == wire.CONTENT_TYPE:
+        records, err = wire.decode(body, REPORT_INTERVAL_DEFAULT)
+        if err:
+            records.append(ValueError(err))
+    else:
+        records = decode_batch(body, ndjson)
+    if not records:
+        return jsonify({"error": "empty or invalid batch"}), 400
+    if len(records) > BATCH_MAX_RECORDS:
+        return jsonify({"error": f"batch too large (max {BATCH_MAX_RECORDS} records)"}), 413
+
+    if INGEST_QUEUE is not None:
+        # Only decode errors are known here; validation happens on the workers
+        queued = [rec for rec in records if not isinstance(rec, Exception)]
+        busy = enqueue(queued) if queued else None
+        if busy:
+            return busy
+        return jsonify({
+            "queued": len(queued),
+            "rejected": len(records) - len(queued),
+            "results": [
+                {"index": i, "status": "error", "error": str(rec)} if isinstance(rec, Exception)
+                else {"index": i, "status": "queued"}
+                for i, rec in enumerate(records)
+            ],
+        }), 202
+
+    # Validate everything first, then apply the good records in one pass
+    results, valid = [], []
+    for i, rec in enumerate(records):
+        try:
+            if isinstance(rec, Exception):
+                raise rec
+            valid.append(parse_payload(rec))
+            results.append({"index": i, "status": "ok"})
+        except ValueError as e:
+            results.append({"index": i, "status": "error", "error": str(e)})
+
+    ingest(valid)
+
+    return jsonify({
+        "accepted": len(valid),
+        "rejected": len(records) - len(valid),
+        "results": results,
+    })
+
+def refresh_status(now: int):
+    # Advance the expiry wheel to `now`, publishing the online -> offline flips that
+    # came due. Also run every second by the expiry thread, so flips happen (and reach
+    # the stream) even when nobody is reading; reads call it to be exact to the second.
+    if now <= EXPIRY.now:
+        return
+    with APPLY_LOCK:
+        due = EXPIRY.advance(now)
+        if SHARED is None:
+            for device_id in due:
+                set_status(device_id, False, touch(device_id))
+            return
+    # Prefork: the flip is written to the shared table once, by whichever worker gets
+    # there first, and every worker applies it from there at the same version
+    for device_id in due:
+        SHARED.expire(device_id, STORE.get(device_id).last_seen)
+    if due:
+        sync_shared()
+
+def _expiry_loop():
+    while True:
+        time.sleep(1.0)
+        sync_shared()
+        refresh_status(int(time.time()))
+        if time.monotonic() - _derived_read < DERIVED_WARM:
+            prepare_derived()
+            with APPLY_LOCK:
+                sync_derived(reading=False)
+
+_expiry_thread = None
+
+@app.before_request
+def start_expiry():
+    # Start the expiry ticker in the serving process on its first request
+    global _expiry_thread
+    if _expiry_thread is None:
+        _expiry_thread = threading.Thread(target=_expiry_loop, name="expiry", daemon=True)
+        _expiry_thread.start()
+
+_checkpoint_thread = None
+
+@app.before_request
+def start_checkpoints():
+    # Start the checkpoint writer in the serving process on its first request
+    global _checkpoint_thread
+    if _checkpoint_thread is None and CHECKPOINTING and WAL_DIR and CHECKPOINT_INTERVAL > 0:
+        _checkpoint_thread = threading.Thread(target=_checkpoint_loop, name="checkpoint", daemon=True)
+        _checkpoint_thread.start()
+
+@app.before_request
+def sync_from_workers():
+    # Prefork mode: answer every read with the changes all workers have published
+    if request.method != "POST":
+        sync_shared()
+
+def capture_snapshot() -> Snapshot:
+    # Latest states in id order with the version they add up to; stored states are
+    # never modified, so everything built from them happens after the lock
     now = int(time.time())
-    rows = []
-    for device_id, rec in sorted(DEVICES.items()):
-        last_seen = int(rec["last_seen"])
-        interval = int(rec.get("interval", REPORT_INTERVAL_DEFAULT))
-        online = mark_online_state(now, last_seen, interval)
-        m = rec["metrics"]
-        sysm = m.get("system", {})
-        netm = m.get("network", {})
-        rows.append({
-            "device_id": device_id,
-            "online": online,
-            "last_seen": last_seen,
-            "last_seen_ago": human_ago(max(0, now - last_seen)),
-            "uptime_s": sysm.get("uptime_s"),
-            "cpu_pct": sysm.get("cpu_pct"),
-            "mem_pct": sysm.get("mem_pct"),
-            "disk_pct": sysm.get("disk_pct"),
-            "loadavg": sysm.get("loadavg"),
-            "iface": netm.get("iface"),
-            "ip": netm.get("ip"),
-            "mac": netm.get("mac"),
-            "rx_bytes": netm.get("rx_bytes"),
-            "tx_bytes": netm.get("tx_bytes"),
-            "rx_packets": netm.get("rx_packets"),
-            "tx_packets": netm.get("tx_packets"),
-        })
-    return rows, now
+    refresh_status(now)
+    with APPLY_LOCK:
+        return Snapshot((VERSION, STATUS_EPOCH), now, [STORE.get(d) for d in DEVICE_INDEX])
+
+# Read side of /, /devices and the SSE catch-up: one published snapshot shared by
+# every reader until the next swap
+SNAPSHOTS = SnapshotPublisher(capture_snapshot, lambda: (VERSION, STATUS_EPOCH),
+                              SNAPSHOT_INTERVAL_MS / 1000, DEVICES_CACHE_MAX_AGE)
+
+def changed_states(since: int, prefix: str = None) -> list:
+    # States changed after `since` in id order, walking the change log newest first
+    with APPLY_LOCK:
+        ids = changed_ids(since)
+        if prefix:
+            ids = [d for d in ids if d.startswith(prefix)]
+        ids.sort()
+        return [STORE.get(d) for d in ids]
+
+def rate_value(v):
+    return round(v, 2) if v is not None else None
+
+def static_row(st: DeviceState) -> dict:
+    # Row fields that only change when the device reports
+    return {
+        "device_id": st.device_id,
+        "last_seen": st.last_seen,
+        "uptime_s": st.uptime_s,
+        "cpu_pct": st.cpu_pct,
+        "mem_pct": st.mem_pct,
+        "disk_pct": st.disk_pct,
+        "loadavg": st.loadavg,
+        "iface": st.iface,
+        "ip": st.ip,
+        "mac": st.mac,
+        "rx_bytes": st.rx_bytes,
+        "tx_bytes": st.tx_bytes,
+        "rx_packets": st.rx_packets,
+        "tx_packets": st.tx_packets,
+        "rx_bytes_ps": rate_value(st.rx_bytes_ps),
+        "tx_bytes_ps": rate_value(st.tx_bytes_ps),
+        "rx_packets_ps": rate_value(st.rx_packets_ps),
+        "tx_packets_ps": rate_value(st.tx_packets_ps),
+    }
+
+def build_row(st: DeviceState, now: int) -> dict:
+    # Flatten one stored state for the dashboard template
+    row = static_row(st)
+    row["online"] = mark_online_state(now, st.last_seen, st.interval)
+    row["last_seen_ago"] = human_ago(max(0, now - st.last_seen))
+    return row
+
+def row_fragment(st: DeviceState) -> bytes:
+    # static_row() serialized once at ingest, left open for row_tail()
+    return json.dumps(static_row(st), separators=(",", ":")).encode()[:-1]
+
+@lru_cache(maxsize=8192)
+def row_tail(online: bool, ago: int) -> bytes:
+    # Time-dependent fields closing a row fragment
+    return (b',"online":true,"last_seen_ago":"' if online else b',"online":false,"last_seen_ago":"') \
+        + human_ago(ago).encode() + b'"}'
+
+def fragment_of(st: DeviceState) -> bytes:
+    # Row fragment of a state, built on first use for states applied without one
+    if not st.fragment:
+        st.fragment = row_fragment(st)
+    return st.fragment
+
+def rows_json(states, now: int) -> bytes:
+    # JSON array of rows assembled from cached fragments
+    return b"[" + b",".join(
+        fragment_of(st) + row_tail(mark_online_state(now, st.last_seen, st.interval), max(0, now - st.last_seen))
+        for st in states
+    ) + b"]"
+
+def listing_json(rows: bytes, **fields) -> bytes:
+    # {"rows": <rows>, **fields} without re-encoding the rows
+    return b'{"rows":' + rows + b"," + json.dumps(fields, separators=(",", ":")).encode()[1:]
+
+def snapshot_ids(snap: Snapshot) -> list:
+    return [st.device_id for st in snap.states]
+
+def snapshot_rows(snap: Snapshot) -> list:
+    # Template rows for every device, sorted by id
+    return [build_row(st, snap.now) for st in snap.states]
+
+def snapshot_listing(snap: Snapshot) -> tuple:
+    # (etag, body, gzip body) of the full /devices listing. The ETag is weak: listings
+    # of the same version differ only in `now` (ages are derived from it), so any
+    # worker's listing of that version satisfies If-None-Match.
+    version = snap.key[0]
+    body = listing_json(rows_json(snap.states, snap.now), now=snap.now, version=version,
+                        boot=BOOT_ID, delta=False)
+    return f"{BOOT_ID}-{version}", body, gzip.compress(body, 6)
+
+def prefix_listing(snap: Snapshot, prefix: str) -> bytes:
+    # Full listing of the ids starting with `prefix`, sliced out of the snapshot
+    ids = snap.memo("ids", snapshot_ids)
+    lo = bisect_left(ids, prefix)
+    states = snap.states[lo:bisect_right(ids, prefix + "\U0010ffff", lo)]
+    return listing_json(rows_json(states, snap.now), now=snap.now, version=snap.key[0],
+                        boot=BOOT_ID, delta=False)
+
+# Identical read requests that overlap share one computation
+FLIGHTS = SingleFlight()
+
+def coalesce(group: str):
+    # Route decorator: concurrent requests with the same path, query string and
+    # conditional/encoding headers run the view once. The leader's response is frozen
+    # to (body, status, headers) and every caller gets a fresh Response built from it.
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, request.query_string, request.headers.get("If-None-Match"),
+                   "gzip" in request.accept_encodings)
+            def compute():
+                resp = app.make_response(view(*args, **kwargs))
+                return resp.get_data(), resp.status_code, list(resp.headers)
+            body, status, headers = FLIGHTS.do(group, key, compute)
+            return Response(body, status=status, headers=headers)
+        return wrapper
+    return decorate
 
 @app.route("/")
+@coalesce("index")
 def index():
     # HTML dashboard
-    rows, now = build_rows()
-    return render_template("index.html", rows=rows, now=now)
+    snap = SNAPSHOTS.current()
+    return render_template("index.html", rows=snap.memo("rows", snapshot_rows), now=snap.now)
+
+def build_delta(since: int, version: int, prefix: str = None) -> bytes:
+    # Rows changed after `since` plus the online/offline flips among them
+    now = int(time.time())
+    refresh_status(now)
+    states = changed_states(since, prefix)
+    transitions = [
+        {"device_id": st.device_id, "online": mark_online_state(now, st.last_seen, st.interval)}
+        for st in states if STATUS_CHANGED.get(st.device_id, 0) > since
+    ]
+    return listing_json(rows_json(states, now), now=now, version=version, boot=BOOT_ID,
+                        delta=True, since=since, transitions=transitions)
+
+def devices_body(since, boot, prefix: str = None) -> tuple:
+    # (JSON body, is_delta): delta after `since` when it belongs to this boot, else a full listing
+    version = VERSION  # read first: anything applied meanwhile is resent next time, never lost
+    if since is None or boot != BOOT_ID or since > version:
+        snap = SNAPSHOTS.current()
+        if prefix:
+            return prefix_listing(snap, prefix), False
+        return snap.memo("listing", snapshot_listing)[1], False
+    return build_delta(since, version, prefix), True
+
+def sort_key(st: DeviceState, col: str, now: int) -> tuple:
+    # Key for sorting on a column without a maintained index
+    if col == "online":
+        return (int(mark_online_state(now, st.last_seen, st.interval)), st.device_id)
+    if col == "last_seen_ago":
+        return (-st.last_seen, st.device_id)
+    if col in query.TEXT_COLUMNS:
+        return (getattr(st, col) or "", st.device_id)
+    return (query.index_key(query.column_value(st, col)), st.device_id)
+
+def query_page(filters, sort: str, desc: bool, cursor, limit: int, prefix: str = None) -> tuple:
+    # (states, next cursor key or None, now) for one page of filtered, sorted rows.
+    # Sorting on device_id or an indexed column walks the maintained index from the
+    # cursor, so a page costs O(page) when filters are not very selective.
+    now = int(time.time())
+    refresh_status(now)
+    pred = query.make_predicate(filters, lambda st: mark_online_state(now, st.last_seen, st.interval))
+    lo = hi = None
+    lo_incl, hi_incl = True, False
+    column = query.INDEX_ALIASES.get(sort, sort)
+    index = None  # a maintained index, taken under APPLY_LOCK below
+    if sort == "device_id":
+        index = DEVICE_INDEX
+        if prefix:
+            lo, hi, hi_incl = prefix, prefix + "\U0010ffff", True
+    elif column in SORT_INDEXES:
+        lo, hi = query.index_range(filters, sort)
+    else:
+        # Stripe locks are taken before APPLY_LOCK, never under it (see APPLY_LOCK);
+        # the states are immutable, so sorting them needs no lock at all
+        index = SortedList(sort_key(st, sort, now) for st in STORE.values())
+    if cursor is not None:
+        if not desc and (lo is None or cursor >= lo):
+            lo, lo_incl = cursor, False
+        elif desc and (hi is None or cursor <= hi):
+            hi, hi_incl = cursor, False
+
+    page = []
+    if index is None:
+        prepare_derived()
+    with APPLY_LOCK:
+        if index is None:
+            sync_derived()
+            index = SORT_INDEXES[column]
+        for key in index.irange(lo, hi, reverse=desc, inclusive=(lo_incl, hi_incl)):
+            device_id = key if sort == "device_id" else key[-1]
+            if prefix and not device_id.startswith(prefix):
+                continue
+            st = STORE.get(device_id)
+            if pred(st):
+                page.append((key, st))
+                if len(page) > limit:
+                    break
+    next_cursor = page[limit - 1][0] if len(page) > limit else None
+    return [st for _, st in page[:limit]], next_cursor, now
 
 @app.route("/devices")
+@coalesce("devices")
 def devices():
-    # JSON used by the auto-refreshing dashboard
-    rows, now = build_rows()
-    return jsonify(rows=rows, now=now)
+    # JSON used by the auto-refreshing dashboard.
+    # With ?since=<version>&boot=<boot_id> only devices changed after that version are
+    # returned, plus the online/offline flips since then; otherwise a full listing,
+    # served from the current read snapshot with ETag / If-None-Match support. ?prefix= limits either
+    # form to device ids starting with that prefix. limit/cursor/sort/order or any
+    # filter (status=offline, iface=eth0, cpu_pct>80) switch to a paged query.
+    try:
+        filters = query.parse_filters(request.query_string.decode())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if filters or any(k in request.args for k in ("limit", "cursor", "sort", "order")):
+        return query_devices(filters)
+
+    since = request.args.get("since", type=int)
+    prefix = request.args.get("prefix") or None
+    if since is not None or prefix:
+        body, _ = devices_body(since, request.args.get("boot", type=int), prefix)
+        return Response(body, mimetype="application/json")
+
+    etag, body, gz = SNAPSHOTS.current().memo("listing", snapshot_listing)
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    elif "gzip" in request.accept_encodings:
+        resp = Response(gz, mimetype="application/json")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+def query_devices(filters):
+    # Paged, filtered, sorted /devices listing
+    sort = request.args.get("sort", "device_id")
+    order = request.args.get("order", "asc")
+    if sort not in query.SORT_COLUMNS:
+        return jsonify({"error": f"unknown sort column: {sort}"}), 400
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "order must be asc or desc"}), 400
+    limit = request.args.get("limit", default=PAGE_LIMIT_MAX, type=int)
+    if not 1 <= limit <= PAGE_LIMIT_MAX:
+        return jsonify({"error": f"limit must be between 1 and {PAGE_LIMIT_MAX}"}), 400
+    cursor = None
+    if request.args.get("cursor"):
+        try:
+            cursor = query.decode_cursor(request.args["cursor"], sort)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    version = VERSION
+    states, next_key, now = query_page(filters, sort, order == "desc", cursor, limit,
+                                       request.args.get("prefix") or None)
+    next_cursor = query.encode_cursor(sort, next_key) if next_key is not None else None
+    body = listing_json(rows_json(states, now), now=now, version=version, boot=BOOT_ID,
+                        delta=False, next_cursor=next_cursor)
+    return Response(body, mimetype="application/json")
+
+def top_k(metric: str, k: int, status=None) -> list:
+    # [(value, state)] for the k highest values of `metric`, read from the end of its
+    # index: O(log n + k) unless a status filter has to skip many devices
+    now = int(time.time())
+    out = []
+    prepare_derived()
+    with APPLY_LOCK:
+        sync_derived()
+        index = SORT_INDEXES[metric]
+        for value, device_id in index.irange(minimum=(query.NEG_INF, "\U0010ffff"), reverse=True,
+                                             inclusive=(False, True)):
+            st = STORE.get(device_id)
+            if status is not None and mark_online_state(now, st.last_seen, st.interval) != status:
+                continue
+            out.append((value, st))
+            if len(out) == k:
+                break
+    return out
+
+@app.route("/devices/top")
+def devices_top():
+    # Devices with the highest current value of a numeric field, e.g. ?metric=cpu_pct&k=20
+    metric = request.args.get("metric", "cpu_pct")
+    metric = query.INDEX_ALIASES.get(metric, metric)
+    if metric not in SORT_INDEXES:
+        return jsonify({"error": f"unknown metric: {metric}", "metrics": list(SORT_INDEXES)}), 400
+    k = request.args.get("k", default=10, type=int)
+    if not 1 <= k <= PAGE_LIMIT_MAX:
+        return jsonify({"error": f"k must be between 1 and {PAGE_LIMIT_MAX}"}), 400
+    status = request.args.get("status")
+    if status not in (None, "online", "offline"):
+        return jsonify({"error": "status must be online or offline"}), 400
+
+    now = int(time.time())
+    refresh_status(now)
+    top = top_k(metric, k, None if status is None else status == "online")
+    body = listing_json(rows_json([st for _, st in top], now), metric=metric, k=k,
+                        values=[v for v, _ in top], now=now)
+    return Response(body, mimetype="application/json")
+
+def history_points(device_id: str, metric: str, t0: int, t1: int, step: int, rate: bool = False):
+    # (source, covered_from, [(start, min, max, avg, last, count)]) or None for an
+    # unknown device. Reads the coarsest rollup tier whose buckets fit in `step` and
+    # still reach t0, so cost tracks the number of output points rather than the time
+    # span; raw samples are used when no tier is fine enough or only they cover the
+    # range, and for metrics that are not rolled up. covered_from is t0, or later
+    # when the source has already evicted the start of the range.
+    # rate=True re-derives per-second rates from a stored counter's raw samples.
+    def read(hist, rollups):
+        # Copy the needed arrays under the stripe lock; resampling happens after it
+        tier = None if rate or metric not in ROLLUP_FIELDS else rollups.pick(t0, step)
+        if tier is None or (not tier.covers(t0) and hist.covers(t0)):
+            ts = hist.ts.values()
+            return "raw", t0 if hist.covers(t0) else ts[0], (
+                ts, hist.field(metric), hist.field("uptime_s") if rate else None)
+        return f"{tier.step}s", t0 if tier.covers(t0) else tier.oldest(), tier.columns(metric)
+
+    found = STORE.read_history(device_id, read)
+    if found is None:
+        return None
+    source, covered, columns = found
+    if source != "raw":
+        return source, covered, resample(columns[0], t0, t1, step, *columns[1:])
+    ts, values, uptimes = columns
+    if rate:
+        # Keep the sample before t0 so the first rate in range has a predecessor
+        i, j = max(0, bisect_left(ts, t0) - 1), bisect_right(ts, t1)
+        ts = ts[i:j]
+        values = rates.counter_rates(ts, values[i:j], uptimes[i:j])
+    ts, values = drop_missing(ts, values)
+    return "raw", covered, resample(ts, t0, t1, step, values)
+
+@app.route("/devices/<device_id>/history")
+@coalesce("history")
+def device_history(device_id):
+    # Resampled history of one metric, e.g. ?metric=cpu_pct&from=<epoch>&to=<epoch>&step=300
+    metric = request.args.get("metric", "cpu_pct")
+    metric = query.INDEX_ALIASES.get(metric, metric)
+    if metric not in HISTORY_FIELDS:
+        return jsonify({"error": f"unknown metric: {metric}", "metrics": list(HISTORY_FIELDS)}), 400
+    rate = request.args.get("rate") in ("1", "true")
+    if rate and metric not in rates.COUNTER_FIELDS:
+        return jsonify({"error": "rate applies to counters only", "metrics": list(rates.COUNTER_FIELDS)}), 400
+    now = int(time.time())
+    t1 = request.args.get("to", default=now, type=int)
+    t0 = request.args.get("from", default=t1 - 3600, type=int)
+    if t0 > t1:
+        return jsonify({"error": "from must not be after to"}), 400
+    step = request.args.get("step", default=max(1, -(-(t1 - t0) // HISTORY_POINTS_DEFAULT)), type=int)
+    if step < 1:
+        return jsonify({"error": "step must be a positive number of seconds"}), 400
+    if (t1 - t0) // step + 1 > HISTORY_POINTS_MAX:
+        return jsonify({"error": f"range/step exceeds {HISTORY_POINTS_MAX} points"}), 400
+
+    found = history_points(device_id, metric, t0, t1, step, rate)
+    if found is None:
+        return jsonify({"error": f"unknown device: {device_id}"}), 404
+    source, covered, points = found
+    starts, mins, maxs, avgs, lasts, counts = zip(*points) if points else ((),) * 6
+    return jsonify({
+        "device_id": device_id,
+        "metric": metric,
+        "rate": rate,
+        "from": t0,
+        "to": t1,
+        "step": step,
+        "source": source,
+        "covered_from": covered,
+        "points": {
+            "ts": starts,
+            "min": mins,
+            "max": maxs,
+            "avg": [round(v, 4) for v in avgs],
+            "last": [v if v == v else None for v in lasts],
+            "count": counts,
+        },
+    })
+
+_streamed_version = 0
+
+def stream_start():
+    # The producer's first delta starts where the first subscriber's catch-up does,
+    # not at version 0 (which would resend every device)
+    global _streamed_version
+    _streamed_version = VERSION
+
+def stream_tick(active: bool):
+    # One coalesced delta per tick for all open streams; nothing when idle
+    global _streamed_version
+    since = _streamed_version
+    if not active:
+        _streamed_version = VERSION
+        return None
+    sync_shared()
+    refresh_status(int(time.time()))
+    version = VERSION
+    if version == since:
+        return None
+    _streamed_version = version
+    return "delta", build_delta(since, version)
+
+STREAM = Broadcaster(stream_tick, tick=SSE_TICK, on_start=stream_start)
+
+@app.route("/devices/stream")
+def devices_stream():
+    # Server-Sent Events: a catch-up message for this client, then shared deltas
+    since, boot = request.args.get("since", type=int), request.args.get("boot", type=int)
+
+    def catch_up() -> bytes:
+        # Built once the client is subscribed, so the shared deltas from then on start
+        # at or before what it covers. A full listing comes from the read snapshot,
+        # which can trail VERSION (and deltas already broadcast), so the changes since
+        # the snapshot follow it as a delta of their own.
+        version = VERSION
+        if since is not None and boot == BOOT_ID and since <= version:
+            return Broadcaster.frame("delta", build_delta(since, version))
+        snap = SNAPSHOTS.current()
+        frames = Broadcaster.frame("full", snap.memo("listing", snapshot_listing)[1])
+        if version > snap.key[0]:
+            frames += Broadcaster.frame("delta", build_delta(snap.key[0], version))
+        return frames
+
+    return Response(STREAM.subscribe(catch_up), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/fleet/summary")
+@coalesce("fleet")
+def fleet_summary():
+    # Fleet-wide counts and online-device aggregates, maintained incrementally
+    refresh_status(int(time.time()))
+    prepare_derived()
+    with APPLY_LOCK:
+        sync_derived()
+        online = ONLINE_COUNT
+        total = len(STORE)
+        metrics = SUMMARY.snapshot()
+    return jsonify({"devices": total, "online": online, "offline": total - online, "metrics": metrics})
+
+@app.route("/fleet/quantiles")
+@coalesce("fleet")
+def fleet_quantiles():
+    # Percentiles of a metric over online devices, e.g. ?metric=cpu_pct&q=0.5,0.95,0.99[&group=site-12]
+    metric = request.args.get("metric", "cpu_pct")
+    metric = query.INDEX_ALIASES.get(metric, metric)
+    if metric not in QUANTILE_FIELDS:
+        return jsonify({"error": f"unknown metric: {metric}", "metrics": list(QUANTILE_FIELDS)}), 400
+    try:
+        qs = [float(q) for q in request.args.get("q", "0.5,0.95,0.99").split(",")]
+    except ValueError:
+        return jsonify({"error": "q must be a comma-separated list of numbers"}), 400
+    if not qs or not all(0.0 <= q <= 1.0 for q in qs):
+        return jsonify({"error": "q values must be between 0 and 1"}), 400
+    group = request.args.get("group")
+
+    refresh_status(int(time.time()))
+    prepare_derived()
+    with APPLY_LOCK:
+        sync_derived()
+        hist = QUANTILES.histogram(metric, group)
+        count = hist.total if hist is not None else 0
+        values = hist.quantiles(qs) if hist is not None else [None] * len(qs)
+    return jsonify({
+        "metric": metric,
+        "group": group,
+        "count": count,
+        "quantiles": {str(q): (round(v, 4) if v is not None else None) for q, v in zip(qs, values)},
+    })
 
 @app.route("/health")
 def health():
-    # Simple health probe
-    return jsonify({"status": "ok"})
+    # Simple health probe with O(1) fleet status counts, request coalescing counters
+    # (plus queue counters in async mode)
+    online = ONLINE_COUNT
+    out = {"status": "ok", "devices": {"online": online, "offline": len(STORE) - online}}
+    if INGEST_QUEUE is not None:
+        out["ingest_queue"] = INGEST_QUEUE.stats()
+    out["coalescing"] = FLIGHTS.stats()
+    return jsonify(out)
+
+def share_state(table):
+    # Prefork parent: seed the shared table with the recovered state before forking,
+    # and renumber the local change log with the versions the table gave each device,
+    # so the workers (which inherit this state by fork) start from the shared count
+    global VERSION, BOOT_ID, _derived_version
+    states = STORE.values()
+    for i in range(0, len(states), BATCH_MAX_RECORDS):
+        table.publish(states[i:i + BATCH_MAX_RECORDS], lambda st: STATUS.get(st.device_id, False),
+                      derive_rates=False)
+    prepare_derived()
+    with APPLY_LOCK:
+        sync_derived(reading=False)
+        CHANGES.clear()
+        STATUS_CHANGED.clear()
+        for version, online, st in table.changes():
+            CHANGES[st.device_id] = STORE.get(st.device_id).version = version
+        VERSION = _derived_version = table.version()
+        BOOT_ID = table.boot_id
+    if WAL is not None:
+        WAL.prune()  # new records go to the workers' logs from here on
+
+def attach_worker(table, worker: int):
+    # Prefork child, right after fork: route ingest through the shared table and log
+    # to this worker's own WAL directory. Versions and the boot id come from the
+    # table, so clients may move between workers freely.
+    global SHARED, WAL, CHECKPOINTING
+    SHARED = table
+    CHECKPOINTING = worker == 0  # every worker holds the whole store; one writes it out
+    if WAL_DIR:
+        WAL = open_wal(os.path.join(WAL_DIR, f"worker-{worker}"))
+    start_expiry()  # its tick also keeps an idle worker caught up with the ring
+    start_checkpoints()
+
+if WAL is not None:
+    recover_from_wal()
 
 if __name__ == "__main__":
     # Bind on all interfaces for Docker; port 8000 per compose
@@ -0,0 +1,93 @@
+import json, sys, timeit
+
+# Cost of validating one agent payload with the compiled schema (schema.py), next to
+# the hand-written extraction it replaced and to json.loads of the same payload:
+#
+#   python bench_schema.py [iterations]
+#
+# "legacy" is the pre-schema path: required keys checked, then numbers kept only
+# when already numeric and strings interned, with no ranges, coercion or errors
+# naming a field. The schema rows add the checks that path lacked.
+import schema
+from state import DeviceState
+
+REPORT_INTERVAL = 10
+REPEAT = 5  # best of
+
+PAYLOAD = {
+    "device_id": "site-1-0001", "ts": 1700000000, "interval": 10,
+    "system": {"uptime_s": 100.0, "cpu_pct": 10.0, "mem_pct": 20.0, "disk_pct": 30.0,
+               "loadavg": [0.1, 0.2, 0.3]},
+    "network": {"iface": "eth0", "ip": "10.0.0.1", "mac": "aa:bb:cc:dd:ee:ff",
+                "rx_bytes": 1000, "tx_bytes": 2000, "rx_packets": 10, "tx_packets": 20},
+}
+# Same values sent as strings, as some agents do: every field takes the slow path
+STRINGLY = {
+    **PAYLOAD, "ts": "1700000000",
+    "system": {k: (str(v) if k != "loadavg" else [str(x) for x in v]) for k, v in PAYLOAD["system"].items()},
+    "network": {k: str(v) for k, v in PAYLOAD["network"].items()},
+}
+REJECTED = {**PAYLOAD, "system": {**PAYLOAD["system"], "cpu_pct": 250}}
+
+def _num(v):
+    if isinstance(v, (int, float)) and not isinstance(v, bool) and v == v:
+        return v
+    return None
+
+def _text(v):
+    if v is None:
+        return None
+    return sys.intern(v if isinstance(v, str) else str(v))
+
+def legacy_parse(payload: dict) -> DeviceState:
+    for k in ("device_id", "ts", "system", "network"):
+        if k not in payload:
+            raise ValueError(f"missing field: {k}")
+    st = DeviceState(sys.intern(str(payload["device_id"])), int(payload["ts"]),
+                     int(payload.get("interval", REPORT_INTERVAL)))
+    sysm = payload.get("system")
+    if isinstance(sysm, dict):
+        st.uptime_s = _num(sysm.get("uptime_s"))
+        st.cpu_pct = _num(sysm.get("cpu_pct"))
+        st.mem_pct = _num(sysm.get("mem_pct"))
+        st.disk_pct = _num(sysm.get("disk_pct"))
+        load = sysm.get("loadavg")
+        if isinstance(load, (list, tuple)) and len(load) >= 3:
+            st.loadavg_1, st.loadavg_5, st.loadavg_15 = _num(load[0]), _num(load[1]), _num(load[2])
+    netm = payload.get("network")
+    if isinstance(netm, dict):
+        st.iface = _text(netm.get("iface"))
+        st.ip = _text(netm.get("ip"))
+        st.mac = _text(netm.get("mac"))
+        st.rx_bytes = _num(netm.get("rx_bytes"))
+        st.tx_bytes = _num(netm.get("tx_bytes"))
+        st.rx_packets = _num(netm.get("rx_packets"))
+        st.tx_packets = _num(netm.get("tx_packets"))
+    return st
+
+def rejecting(parse, payload):
+    def run():
+        try:
+            parse(payload)
+        except ValueError:
+            pass
+    return run
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    parse = schema.compile_payload(schema.PAYLOAD, REPORT_INTERVAL)
+    raw = json.dumps(PAYLOAD).encode()
+    cases = (
+        ("json.loads (for scale)", lambda: json.loads(raw)),
+        ("legacy", lambda: legacy_parse(PAYLOAD)),
+        ("schema", lambda: parse(PAYLOAD)),
+        ("schema, string values", lambda: parse(STRINGLY)),
+        ("schema, rejected", rejecting(parse, REJECTED)),
+    )
+    print(f"[bench] {n} payloads per run, best of {REPEAT}")
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=n, repeat=REPEAT))
+        print(f"{name:24} {best / n * 1e6:7.2f} µs/payload")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import faulthandler, sys, threading, time
+
+# Contention benchmark for the striped device store: N writer threads ingest samples
+# for devices of their own while reader threads hit the read endpoints, including
+# sorts on columns without an index, which scan the whole store.
+#
+#   python bench_store.py [seconds per round] [writer counts...]
+#
+# Prints writes/s and reads/s per round and checks the fleet-wide counters and the
+# sort indexes (caught up first) after it.
+# Exits 1 (after dumping every thread's stack) if a round does not finish within
+# the watchdog timeout, i.e. on a deadlock.
+import app
+
+DEVICES_PER_WRITER = 200
+READERS = 4
+READ_PATHS = (
+    "/devices?sort=mac&limit=10",
+    "/devices?sort=online&order=desc&limit=10",
+    "/devices?sort=cpu_pct&limit=50",
+    "/devices",
+    "/fleet/summary",
+)
+WATCHDOG = 30.0  # seconds past the end of a round before it is declared hung
+
+def payload(device_id: str, ts: int, i: int) -> dict:
+    return {
+        "device_id": device_id, "ts": ts, "interval": 10,
+        "system": {"uptime_s": 1000 + i, "cpu_pct": i % 100, "mem_pct": 40.0, "disk_pct": 50.0,
+                   "loadavg": [0.5, 0.4, 0.3]},
+        "network": {"iface": "eth0", "ip": "10.0.0.1", "mac": f"aa:bb:cc:{i % 256:02x}",
+                    "rx_bytes": 1000 * i, "tx_bytes": 500 * i, "rx_packets": i, "tx_packets": i},
+    }
+
+def run(writers: int, seconds: float) -> bool:
+    stop = threading.Event()
+    writes = [0] * writers
+    reads = [0] * READERS
+
+    def write(w: int):
+        # Each pass over the writer's devices is one second later, so no sample is
+        # dropped as older than the one its device holds
+        i, base = 0, int(time.time())
+        while not stop.is_set():
+            device_id = f"bench-{w}-{i % DEVICES_PER_WRITER}"
+            app.ingest((app.parse_payload(payload(device_id, base + i // DEVICES_PER_WRITER, i)),))
+            writes[w] += 1
+            i += 1
+
+    def read(r: int):
+        client = app.app.test_client()
+        i = r
+        while not stop.is_set():
+            resp = client.get(READ_PATHS[i % len(READ_PATHS)])
+            if resp.status_code != 200:
+                print(f"  read {READ_PATHS[i % len(READ_PATHS)]} -> {resp.status_code}")
+            reads[r] += 1
+            i += 1
+
+    threads = [threading.Thread(target=write, args=(w,), daemon=True) for w in range(writers)]
+    threads += [threading.Thread(target=read, args=(r,), daemon=True) for r in range(READERS)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    deadline = time.monotonic() + WATCHDOG
+    for t in threads:
+        t.join(max(0.0, deadline - time.monotonic()))
+    if any(t.is_alive() for t in threads):
+        print(f"{writers:4d} writers: HUNG (threads still running {WATCHDOG:.0f}s after stop)")
+        faulthandler.dump_traceback(all_threads=True)
+        return False
+    elapsed = time.perf_counter() - started
+    app.prepare_derived()
+    with app.APPLY_LOCK:
+        app.sync_derived(reading=False)
+        online = sum(1 for v in app.STATUS.values() if v)
+        ok = (online == app.ONLINE_COUNT and len(app.DEVICE_INDEX) == len(app.STORE)
+              and all(len(index) == len(app.STORE) for index in app.SORT_INDEXES.values()))
+    print(f"{writers:4d} writers: {sum(writes) / elapsed:9.0f} writes/s  "
+          f"{sum(reads) / elapsed:7.0f} reads/s  devices={len(app.STORE)}  "
+          f"invariants {'ok' if ok else 'BROKEN'}")
+    return ok
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    counts = [int(a) for a in sys.argv[2:]] or [8, 32, 128]
+    print(f"[bench] {len(app.STORE.stripes)} stripes, {READERS} readers, {seconds:.0f}s per round")
+    for writers in counts:
+        if not run(writers, seconds):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import gzip, json, random, sys, time
+
+# Size and decode speed of the binary wire format against JSON, for one record and
+# for a batch body of many:
+#
+#   python bench_wire.py [records per batch]
+#
+# Decode covers what ingest does with a body before applying it: JSON is parsed and
+# run through the compiled schema, binary is unpacked by wire.decode() and given the
+# same range checks.
+import schema
+import wire
+
+REPORT_INTERVAL = 10
+REPEAT = 5  # best of
+
+def payload(i: int) -> dict:
+    r = random.Random(i)
+    return {
+        "device_id": f"site-{i // 100}-{i:05d}", "ts": 1700000000 + i, "interval": REPORT_INTERVAL,
+        "system": {"uptime_s": round(r.uniform(0, 1e6), 1), "cpu_pct": round(r.uniform(0, 100), 2),
+                   "mem_pct": round(r.uniform(0, 100), 2), "disk_pct": round(r.uniform(0, 100), 2),
+                   "loadavg": [round(r.uniform(0, 4), 2) for _ in range(3)]},
+        "network": {"iface": "eth0", "ip": f"10.{i % 256}.{i // 256 % 256}.7", "mac": "02:42:ac:11:00:02",
+                    "rx_bytes": r.randrange(1 << 40), "tx_bytes": r.randrange(1 << 40),
+                    "rx_packets": r.randrange(1 << 32), "tx_packets": r.randrange(1 << 32)},
+    }
+
+def best(fn, n: int) -> float:
+    # Fastest of REPEAT runs, in microseconds per record
+    times = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times) / n * 1e6
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    payloads = [payload(i) for i in range(n)]
+    parse = schema.compile_payload(schema.PAYLOAD, REPORT_INTERVAL)
+    check = schema.compile_state_check(schema.PAYLOAD)
+    json_one = [json.dumps(p, separators=(",", ":")).encode() for p in payloads]
+    json_batch = b"[" + b",".join(json_one) + b"]"
+    bin_one = [wire.encode(p) for p in payloads]
+    bin_batch = b"".join(bin_one)
+
+    def decode_json():
+        for p in json.loads(json_batch):
+            parse(p)
+
+    def decode_binary():
+        states, err = wire.decode(bin_batch, REPORT_INTERVAL)
+        for st in states:
+            check(st)
+
+    print(f"[bench] {n} records")
+    print(f"{'':8} {'bytes/record':>12} {'gzip batch':>11} {'decode µs/record':>17}")
+    for name, one, batch, decode in (("json", json_one, json_batch, decode_json),
+                                     ("binary", bin_one, bin_batch, decode_binary)):
+        print(f"{name:8} {sum(map(len, one)) / n:12.1f} {len(gzip.compress(batch, 6)) / n:11.1f} "
+              f"{best(decode, n):17.2f}")
+
+if __name__ == "__main__":
+    main()
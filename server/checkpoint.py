@@ -0,0 +1,103 @@
+import json, mmap, os, struct, zlib
+
+from history import HISTORY_FIELDS, DeviceHistory
+from rates import RATE_FIELDS
+from rollup import ROLLUP_FIELDS, DeviceRollups
+from state import DeviceState
+from wal import FRAME
+
+# Point-in-time copy of the device store: every device's latest state with its
+# history rings and rollup tiers, dumped as raw arrays. Recovery loads it in bulk
+# and replays only the log written since, instead of every sample in the log.
+# One file framed like the WAL (<length, crc32> + data), written to a temporary
+# name and renamed over the previous checkpoint. The first frame describes the
+# layout; a checkpoint taken with other history/rollup settings is ignored.
+CHECKPOINT_FILE = "checkpoint.bin"
+STATE_LENGTH = struct.Struct("<I")
+
+def layout(history_capacity: int, rollup_tiers) -> dict:
+    # Settings a checkpoint depends on
+    return {"history_capacity": history_capacity, "rollup_tiers": [list(t) for t in rollup_tiers],
+            "fields": list(HISTORY_FIELDS), "rollup_fields": list(ROLLUP_FIELDS)}
+
+def encode_device(state: DeviceState, hist: DeviceHistory, rollups: DeviceRollups) -> bytes:
+    # One device: its latest state (WAL record fields plus rates), history and rollups
+    rec = json.dumps([getattr(state, k) for k in DeviceState.RECORD_FIELDS + RATE_FIELDS],
+                     separators=(",", ":")).encode()
+    return STATE_LENGTH.pack(len(rec)) + rec + hist.dump() + rollups.dump()
+
+def decode_device(data, history_capacity: int, rollup_tiers) -> tuple:
+    # (state, history, rollups) from encode_device() output
+    n = STATE_LENGTH.unpack_from(data)[0]
+    off = STATE_LENGTH.size + n
+    rec = data[STATE_LENGTH.size:off]
+    st = DeviceState.from_record(rec)  # takes the record fields, leaves the rates
+    st.rx_bytes_ps, st.tx_bytes_ps, st.rx_packets_ps, st.tx_packets_ps = \
+        json.loads(rec)[len(DeviceState.RECORD_FIELDS):]
+    hist = DeviceHistory(history_capacity)
+    rollups = DeviceRollups(rollup_tiers)
+    off = rollups.load(data, hist.load(data, off))
+    if off != len(data):
+        raise ValueError("trailing bytes in device entry")
+    return st, hist, rollups
+
+def write(directory: str, started: float, settings: dict, entries) -> int:
+    # Write a checkpoint of `entries` (encode_device() outputs) taken at `started`;
+    # returns the number of devices
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    tmp = path + ".tmp"
+    n = 0
+    with open(tmp, "wb") as f:
+        head = json.dumps({"started": started, **settings}).encode()
+        f.write(FRAME.pack(len(head), zlib.crc32(head)) + head)
+        for data in entries:
+            f.write(FRAME.pack(len(data), zlib.crc32(data)) + data)
+            n += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)  # make the rename durable
+    finally:
+        os.close(fd)
+    return n
+
+def read(directory: str, settings: dict):
+    # (started, [(state, history, rollups)]) from the checkpoint in `directory`, or
+    # None when there is none or it cannot be used (other settings, damaged)
+    path = os.path.join(directory, CHECKPOINT_FILE)
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                frames = _frames(mm)
+                head = json.loads(next(frames))
+                if {k: head.get(k) for k in settings} != settings:
+                    print("[server] checkpoint ignored: taken with other history/rollup settings")
+                    return None
+                devices = [decode_device(data, settings["history_capacity"], settings["rollup_tiers"])
+                           for data in frames]
+            except (ValueError, StopIteration, struct.error) as e:
+                print(f"[server] checkpoint ignored: {e or 'empty'}")
+                return None
+    return head["started"], devices
+
+def _frames(mm):
+    # Payloads of the frames in `mm`; unlike the WAL, a bad frame spoils the whole file
+    off, end = 0, len(mm)
+    while off < end:
+        if off + FRAME.size > end:
+            raise ValueError("truncated frame")
+        length, crc = FRAME.unpack_from(mm, off)
+        off += FRAME.size
+        data = mm[off:off + length]
+        if len(data) != length or zlib.crc32(data) != crc:
+            raise ValueError("corrupt frame")
+        off += length
+        yield data
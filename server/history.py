@@ -0,0 +1,166 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import compress
+import math, struct
+
+# Numeric fields kept per sample, in storage order
+HISTORY_FIELDS = (
+    "cpu_pct", "mem_pct", "disk_pct",
+    "loadavg_1", "loadavg_5", "loadavg_15",
+    "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+    "rx_bytes_ps", "tx_bytes_ps", "rx_packets_ps", "tx_packets_ps",
+    "uptime_s",
+)
+MISSING = float("nan")  # stored when an agent omits a field
+RING_HEADER = struct.Struct("<II")  # head, length of a dumped ring
+
+class RingBuffer:
+    # Fixed-capacity circular buffer over a typed array.
+    # Grows up to `capacity` items, then overwrites the oldest; append is O(1).
+    __slots__ = ("capacity", "data", "head")
+
+    def __init__(self, capacity: int, typecode: str = "d"):
+        self.capacity = max(1, int(capacity))
+        self.data = array(typecode)
+        self.head = 0  # next slot to overwrite once full
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def append(self, value):
+        if len(self.data) < self.capacity:
+            self.data.append(value)
+        else:
+            self.data[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+
+    def extend(self, values):
+        # Append many values at once; only the newest `capacity` of them can survive
+        values = values[-self.capacity:]
+        room = self.capacity - len(self.data)
+        if room:
+            self.data.extend(values[:room])
+            values = values[room:]
+        while values:
+            # Overwrite the oldest slots in at most two slices
+            end = min(self.capacity, self.head + len(values))
+            self.data[self.head:end] = array(self.data.typecode, values[:end - self.head])
+            values = values[end - self.head:]
+            self.head = end % self.capacity
+
+    def last(self):
+        # Most recently appended value (IndexError when empty)
+        return self.data[self.head - 1]
+
+    def values(self) -> array:
+        # Copy of the contents ordered oldest -> newest
+        if self.head == 0:
+            return self.data[:]
+        return self.data[self.head:] + self.data[:self.head]
+
+    def nbytes(self) -> int:
+        return self.capacity * self.data.itemsize
+
+    def dump(self) -> bytes:
+        # Head, length and raw contents, for checkpoints
+        return RING_HEADER.pack(self.head, len(self.data)) + self.data.tobytes()
+
+    def load(self, buf, off: int) -> int:
+        # Restore what dump() wrote at buf[off:]; returns the offset just past it
+        self.head, n = RING_HEADER.unpack_from(buf, off)
+        off += RING_HEADER.size
+        end = off + n * self.data.itemsize
+        if n > self.capacity or end > len(buf):
+            raise ValueError("ring does not fit")
+        self.data = array(self.data.typecode)
+        self.data.frombytes(buf[off:end])
+        return end
+
+class DeviceHistory:
+    # Per-device sample history: one timestamp ring plus one ring per numeric field.
+    # Samples are passed as a tuple aligned with HISTORY_FIELDS, so appending
+    # allocates nothing per sample beyond the array slots themselves.
+    __slots__ = ("ts", "series")
+
+    def __init__(self, capacity: int):
+        self.ts = RingBuffer(capacity, "q")
+        self.series = tuple(RingBuffer(capacity, "d") for _ in HISTORY_FIELDS)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def append(self, ts: int, values) -> bool:
+        # Keep timestamps strictly increasing; late or duplicate samples are dropped
+        if len(self.ts) and ts <= self.ts.last():
+            return False
+        self.ts.append(ts)
+        for ring, v in zip(self.series, values):
+            ring.append(MISSING if v is None else v)
+        return True
+
+    def extend(self, ts: list, rows: list) -> int:
+        # Append many samples (increasing ts, tuples aligned with HISTORY_FIELDS) column
+        # by column; those not newer than the last one held are dropped. Returns how
+        # many were kept.
+        if len(self.ts):
+            last = self.ts.last()
+            skip = 0
+            while skip < len(ts) and ts[skip] <= last:
+                skip += 1
+            ts, rows = ts[skip:], rows[skip:]
+        if not ts:
+            return 0
+        self.ts.extend(ts)
+        rows = rows[-self.ts.capacity:]
+        for ring, column in zip(self.series, zip(*rows)):
+            ring.extend([MISSING if v is None else v for v in column])
+        return len(ts)
+
+    def covers(self, t0: int) -> bool:
+        # True when no sample at or after t0 has been overwritten yet
+        return len(self.ts) < self.ts.capacity or self.ts.values()[0] <= t0
+
+    def field(self, name: str) -> array:
+        # Ordered values of one field (oldest -> newest)
+        return self.series[HISTORY_FIELDS.index(name)].values()
+
+    def nbytes(self) -> int:
+        # Upper bound on sample storage once the rings are full
+        return self.ts.nbytes() + sum(r.nbytes() for r in self.series)
+
+    def dump(self) -> bytes:
+        return b"".join(ring.dump() for ring in (self.ts,) + self.series)
+
+    def load(self, buf, off: int) -> int:
+        for ring in (self.ts,) + self.series:
+            off = ring.load(buf, off)
+        return off
+
+def drop_missing(ts: array, values: array) -> tuple:
+    # (ts, values) without the NaN placeholders, filtered in C via compress()
+    keep = list(map(math.isnan, values))
+    if not any(keep):
+        return ts, values
+    keep = [not k for k in keep]
+    return array(ts.typecode, compress(ts, keep)), array(values.typecode, compress(values, keep))
+
+def resample(ts, t0: int, t1: int, step: int, mins, maxs=None, sums=None, lasts=None, counts=None) -> list:
+    # Aggregate points with ts in [t0, t1] into step-aligned buckets:
+    # [(bucket_start, min, max, avg, last, count)]. Raw samples pass only `mins`
+    # (one value each); rollup columns pass all five. Work per bucket is a bisect
+    # plus min/max/sum over array slices, so there is no Python loop per point and
+    # empty stretches are skipped in one bisect.
+    maxs = mins if maxs is None else maxs
+    sums = mins if sums is None else sums
+    lasts = mins if lasts is None else lasts
+    i, end = bisect_left(ts, t0), bisect_right(ts, t1)
+    out = []
+    while i < end:
+        start = ts[i] - ts[i] % step
+        j = bisect_left(ts, start + step, i, end)
+        n = sum(counts[i:j]) if counts is not None else j - i
+        if n:
+            last = next((v for v in reversed(lasts[i:j]) if v == v), MISSING)
+            out.append((start, min(mins[i:j]), max(maxs[i:j]), sum(sums[i:j]) / n, last, n))
+        i = j
+    return out
@@ -0,0 +1,76 @@
+import threading
+from collections import deque
+
+class IngestQueue:
+    # Bounded queue of decoded records drained in batches by background workers.
+    # `depth` caps queued records (not requests); offer() refuses work past it so
+    # the HTTP layer can answer 503 instead of letting memory grow. apply_batch()
+    # returns how many of its records failed validation (counted as invalid).
+    def __init__(self, apply_batch, depth: int = 10000, workers: int = 1, batch_size: int = 500):
+        self.apply_batch = apply_batch
+        self.depth = depth
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.accepted = 0
+        self.rejected = 0
+        self.applied = 0
+        self.invalid = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _start(self):
+        # Workers start on first use so forked server processes get their own
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def offer(self, records) -> bool:
+        # Enqueue all records or none of them; False means the queue is full
+        with self._cond:
+            if not self._threads:
+                self._start()
+            if len(self._items) + len(records) > self.depth:
+                self.rejected += len(records)
+                return False
+            self._items.extend(records)
+            self.accepted += len(records)
+            self._cond.notify(len(records) // self.batch_size + 1)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                n = min(len(self._items), self.batch_size)
+                batch = [self._items.popleft() for _ in range(n)]
+            try:
+                invalid = self.apply_batch(batch) or 0
+                ok = True
+            except Exception as e:
+                ok = False
+                print(f"[server] ingest worker error: {e}")
+            with self._cond:
+                if ok:
+                    self.applied += n - invalid
+                    self.invalid += invalid
+                else:
+                    self.failed += n
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._items),
+            "depth": self.depth,
+            "workers": self.workers,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "applied": self.applied,
+            "invalid": self.invalid,
+            "failed": self.failed,
+        }
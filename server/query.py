@@ -0,0 +1,139 @@
+import base64, json, math, re
+from urllib.parse import unquote_plus
+
+# Row columns usable in sort= and filters (see static_row() in app.py)
+NUMERIC_COLUMNS = (
+    "last_seen", "uptime_s", "cpu_pct", "mem_pct", "disk_pct", "loadavg",
+    "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+    "rx_bytes_ps", "tx_bytes_ps", "rx_packets_ps", "tx_packets_ps",
+)
+TEXT_COLUMNS = ("device_id", "iface", "ip", "mac")
+SORT_COLUMNS = NUMERIC_COLUMNS + TEXT_COLUMNS + ("online", "last_seen_ago")
+# Row columns answered by an index on a differently named DeviceState field
+INDEX_ALIASES = {"loadavg": "loadavg_1"}
+NEG_INF = float("-inf")
+
+_FILTER = re.compile(r"^([A-Za-z_0-9]+)(>=|<=|!=|>|<|=)(.*)$")
+
+def index_key(v) -> float:
+    # Sortable numeric value: missing (None/NaN) sorts below every real value
+    return NEG_INF if v is None or v != v else v
+
+def column_value(st, col: str):
+    # Raw value of a row column on a DeviceState (loadavg compares by its 1m value)
+    return st.loadavg_1 if col == "loadavg" else getattr(st, col)
+
+def is_filter_column(col: str) -> bool:
+    return col in ("status", "online") or col in TEXT_COLUMNS or col in NUMERIC_COLUMNS
+
+def parse_filters(query_string: str) -> list:
+    # "status=offline&iface=eth0&cpu_pct>80" -> [(column, op, value)].
+    # Parsed from the raw query string because "cpu_pct>80" is not a key=value pair.
+    # Plain key=value pairs (and bare keys) naming no filter column are other query
+    # parameters, e.g. a cache buster "_=123", and are skipped; a comparison on an
+    # unknown column is an error.
+    filters = []
+    for part in query_string.split("&"):
+        part = unquote_plus(part)
+        if not part:
+            continue
+        key = part.partition("=")[0]
+        if not any(c in key for c in "<>!") and not is_filter_column(key):
+            continue
+        m = _FILTER.match(part)
+        if not m:
+            raise ValueError(f"invalid filter: {part!r}")
+        col, op, value = m.groups()
+        if col in ("status", "online"):
+            if op not in ("=", "!=") or value not in ("online", "offline", "true", "false"):
+                raise ValueError(f"invalid filter: {part!r}")
+            want = value in ("online", "true")
+            filters.append(("online", "=" if op == "=" else "!=", want))
+        elif col in TEXT_COLUMNS:
+            if op not in ("=", "!="):
+                raise ValueError(f"only = and != apply to {col}")
+            filters.append((col, op, value))
+        elif col in NUMERIC_COLUMNS:
+            try:
+                filters.append((col, op, float(value)))
+            except ValueError:
+                raise ValueError(f"invalid number in filter: {part!r}")
+        else:
+            raise ValueError(f"unknown filter column: {col}")
+    return filters
+
+_OPS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+}
+
+def make_predicate(filters, online_of):
+    # DeviceState -> bool for all filters; online_of(st) gives the current status
+    checks = []
+    for col, op, value in filters:
+        fn = _OPS[op]
+        if col == "online":
+            checks.append(lambda st, fn=fn, value=value: fn(online_of(st), value))
+        elif col in TEXT_COLUMNS:
+            checks.append(lambda st, col=col, fn=fn, value=value: fn(getattr(st, col) or "", value))
+        else:
+            def check(st, col=col, fn=fn, value=value):
+                v = column_value(st, col)
+                return v is not None and v == v and fn(v, value)
+            checks.append(check)
+    return lambda st: all(c(st) for c in checks)
+
+def index_range(filters, col: str) -> tuple:
+    # (minimum, maximum, inclusive) bounds on (value, device_id) index keys implied
+    # by numeric filters on the sort column itself, so the scan starts in range
+    lo, hi = None, None
+    for fcol, op, value in filters:
+        if fcol != col:
+            continue
+        if op in (">", ">="):
+            b = (value if op == ">=" else math.nextafter(value, math.inf),)
+            lo = b if lo is None else max(lo, b)
+        elif op in ("<", "<="):
+            b = (value if op == "<" else math.nextafter(value, math.inf),)
+            hi = b if hi is None else min(hi, b)
+        elif op == "=":
+            lo = (value,) if lo is None else max(lo, (value,))
+            b = (math.nextafter(value, math.inf),)
+            hi = b if hi is None else min(hi, b)
+    return lo, hi
+
+def encode_cursor(sort: str, key) -> str:
+    # Opaque resume token holding the sort column and the last returned sort key
+    if isinstance(key, tuple):
+        key = [None if k == NEG_INF else k for k in key]
+    token = json.dumps([sort, key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+def decode_cursor(token: str, sort: str):
+    # Sort key from encode_cursor(); ValueError unless the token was made for `sort`
+    # and its key has that sort's shape: the id itself for device_id, otherwise
+    # (value, device_id) with a string value for text columns and a number (or
+    # null, a missing value) for the rest
+    try:
+        cur_sort, key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor") from None
+    if cur_sort != sort:
+        raise ValueError(f"cursor was issued for sort={cur_sort}, not sort={sort}")
+    if sort == "device_id":
+        if isinstance(key, str):
+            return key
+    elif isinstance(key, list) and len(key) == 2 and isinstance(key[1], str):
+        value = key[0]
+        if sort in TEXT_COLUMNS:
+            if isinstance(value, str):
+                return value, key[1]
+        elif value is None:
+            return NEG_INF, key[1]
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            return value, key[1]
+    raise ValueError("invalid cursor")
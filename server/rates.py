@@ -0,0 +1,54 @@
+from array import array
+from itertools import compress, repeat
+from operator import lt, sub, truediv
+
+# Cumulative NIC counters sent by the agent and the per-second rates derived from them
+COUNTER_FIELDS = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets")
+RATE_FIELDS = ("rx_bytes_ps", "tx_bytes_ps", "rx_packets_ps", "tx_packets_ps")
+WRAP32 = 1 << 32
+WRAP64 = 1 << 64
+NAN = float("nan")
+
+def counter_delta(prev, cur):
+    # Increase of a monotonic counter between two reads, allowing for one wrap at
+    # 32 or 64 bits (picked from the previous value). A drop that would need more
+    # than half the counter range to explain is a reset, not a wrap: None.
+    if cur >= prev:
+        return cur - prev
+    width = WRAP32 if prev < WRAP32 else WRAP64
+    delta = cur + width - prev
+    return delta if delta < width // 2 else None
+
+def rebooted(prev_uptime, cur_uptime) -> bool:
+    # Uptime going backwards means the counters restarted from zero
+    return prev_uptime is not None and cur_uptime is not None and cur_uptime < prev_uptime
+
+def sample_rates(prev, cur) -> tuple:
+    # Per-second rates for RATE_FIELDS from the previous and current DeviceState;
+    # None where there is no usable previous reading (first sample, reboot, reset)
+    if prev is None or cur.last_seen <= prev.last_seen or rebooted(prev.uptime_s, cur.uptime_s):
+        return (None,) * len(RATE_FIELDS)
+    dt = cur.last_seen - prev.last_seen
+    out = []
+    for f in COUNTER_FIELDS:
+        a, b = getattr(prev, f), getattr(cur, f)
+        delta = counter_delta(a, b) if a is not None and b is not None else None
+        out.append(delta / dt if delta is not None else None)
+    return tuple(out)
+
+def counter_rates(ts, counters, uptimes) -> array:
+    # Rates over a stored range of samples (typed arrays, oldest first), NaN where
+    # sample_rates() would give None. Differences and divisions run as map() over
+    # the arrays; only the rare negative deltas and reboots are revisited one by one.
+    n = len(ts)
+    if n < 2:
+        return array("d", repeat(NAN, n))
+    deltas = list(map(sub, counters[1:], counters[:-1]))
+    for i in compress(range(n - 1), map(lt, deltas, repeat(0))):
+        delta = counter_delta(counters[i], counters[i + 1])
+        deltas[i] = NAN if delta is None else delta
+    for i in compress(range(n - 1), map(lt, uptimes[1:], uptimes[:-1])):
+        deltas[i] = NAN
+    out = array("d", [NAN])
+    out.extend(map(truediv, deltas, map(sub, ts[1:], ts[:-1])))
+    return out
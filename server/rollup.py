@@ -0,0 +1,231 @@
+from array import array
+from operator import itemgetter
+import struct
+
+from history import HISTORY_FIELDS
+
+# Fields kept in rollups: what long-range charts ask for. The NIC counters are kept
+# as their per-second rates only (min/max/avg of an ever-growing counter says little);
+# uptime_s and the 5/15-minute load averages, already smoothed, are left to the raw
+# history.
+ROLLUP_FIELDS = (
+    "cpu_pct", "mem_pct", "disk_pct", "loadavg_1",
+    "rx_bytes_ps", "tx_bytes_ps", "rx_packets_ps", "tx_packets_ps",
+)
+NF = len(ROLLUP_FIELDS)
+# Picks the rolled-up values out of a sample tuple in HISTORY_FIELDS order
+pick_fields = itemgetter(*(HISTORY_FIELDS.index(f) for f in ROLLUP_FIELDS))
+INF = float("inf")
+NAN = float("nan")
+RING_HEADER = struct.Struct("<II")  # head, buckets of a dumped tier
+COLUMNS = ("starts", "mins", "maxs", "sums", "lasts", "counts")  # per-tier arrays, in dump order
+
+def parse_tiers(spec: str) -> tuple:
+    # "60:21600,300:259200" -> ((60, 21600), (300, 259200)), finest step first
+    tiers = []
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        step, _, retention = part.partition(":")
+        step, retention = int(step), int(retention)
+        if step <= 0 or retention < step:
+            raise ValueError(f"invalid rollup tier: {part!r}")
+        tiers.append((step, retention))
+    return tuple(sorted(tiers))
+
+class RollupRing:
+    # min/max/sum/count/last per field over fixed `step`-second buckets.
+    # Buckets live in a ring of retention // step slots; per-field stats are
+    # interleaved (slot * NF + field) so one tier is six flat arrays.
+    __slots__ = ("step", "retention", "capacity", "head",
+                 "starts", "mins", "maxs", "sums", "lasts", "counts")
+
+    def __init__(self, step: int, retention: int):
+        self.step = step
+        self.retention = retention
+        self.capacity = max(1, retention // step)
+        self.head = 0  # next slot to overwrite once full
+        self.starts = array("q")
+        self.mins = array("d")
+        self.maxs = array("d")
+        self.sums = array("d")
+        self.lasts = array("d")
+        self.counts = array("I")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def _newest(self) -> int:
+        return (self.head - 1) % len(self.starts)
+
+    def _open(self, start: int) -> int:
+        # Start a new bucket, reusing the oldest slot once the ring is full
+        if len(self.starts) < self.capacity:
+            self.starts.append(start)
+            self.mins.extend((INF,) * NF)
+            self.maxs.extend((-INF,) * NF)
+            self.sums.extend((0.0,) * NF)
+            self.lasts.extend((NAN,) * NF)
+            self.counts.extend((0,) * NF)
+            return len(self.starts) - 1
+        slot = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.starts[slot] = start
+        base = slot * NF
+        for i in range(base, base + NF):
+            self.mins[i] = INF
+            self.maxs[i] = -INF
+            self.sums[i] = 0.0
+            self.lasts[i] = NAN
+            self.counts[i] = 0
+        return slot
+
+    def add(self, ts: int, values):
+        # Fold one sample (tuple in ROLLUP_FIELDS order) into its bucket.
+        # Callers feed samples in increasing ts order; older buckets are closed.
+        start = ts - ts % self.step
+        if len(self.starts) and self.starts[self._newest()] == start:
+            slot = self._newest()
+        elif not len(self.starts) or start > self.starts[self._newest()]:
+            slot = self._open(start)
+        else:
+            return
+        base = slot * NF
+        for i, v in enumerate(values, base):
+            if v is None or v != v:
+                continue
+            if v < self.mins[i]:
+                self.mins[i] = v
+            if v > self.maxs[i]:
+                self.maxs[i] = v
+            self.sums[i] += v
+            self.lasts[i] = v
+            self.counts[i] += 1
+
+    def extend(self, ts: list, rows: list):
+        # Fold many samples (increasing ts) into their buckets, aggregating each
+        # bucket's samples a column at a time instead of value by value
+        step, i, n = self.step, 0, len(ts)
+        while i < n:
+            start = ts[i] - ts[i] % step
+            j = i + 1
+            while j < n and ts[j] < start + step:
+                j += 1
+            if len(self.starts) and self.starts[self._newest()] == start:
+                slot = self._newest()
+            elif not len(self.starts) or start > self.starts[self._newest()]:
+                slot = self._open(start)
+            else:
+                i = j
+                continue
+            base = slot * NF
+            for f, column in enumerate(zip(*rows[i:j]), base):
+                vals = [v for v in column if v is not None and v == v]
+                if not vals:
+                    continue
+                lo, hi = min(vals), max(vals)
+                if lo < self.mins[f]:
+                    self.mins[f] = lo
+                if hi > self.maxs[f]:
+                    self.maxs[f] = hi
+                self.sums[f] = sum(vals, self.sums[f])
+                self.lasts[f] = vals[-1]
+                self.counts[f] += len(vals)
+            i = j
+
+    def _ordered(self, column: array) -> array:
+        # Copy of a slot-ordered column rotated to oldest -> newest
+        if len(self.starts) < self.capacity or self.head == 0:
+            return column[:]
+        return column[self.head:] + column[:self.head]
+
+    def columns(self, field: str) -> tuple:
+        # (starts, mins, maxs, sums, lasts, counts) of one field as typed arrays,
+        # oldest bucket first. Strided slices pull the field out of the interleaved
+        # storage without a Python loop.
+        f = ROLLUP_FIELDS.index(field)
+        return (
+            self._ordered(self.starts),
+            self._ordered(self.mins[f::NF]),
+            self._ordered(self.maxs[f::NF]),
+            self._ordered(self.sums[f::NF]),
+            self._ordered(self.lasts[f::NF]),
+            self._ordered(self.counts[f::NF]),
+        )
+
+    def nbytes(self) -> int:
+        # Storage once the ring is full: a start per bucket, then min/max/sum/last
+        # (8 bytes each) and a count (4 bytes) per field
+        return self.capacity * (8 + NF * (4 * 8 + 4))
+
+    def oldest(self) -> int:
+        # Start of the oldest bucket still inside the retention window
+        newest = self.starts[self._newest()]
+        return max(min(self.starts), newest - self.retention + self.step)
+
+    def covers(self, t0: int) -> bool:
+        # True when nothing at or after t0 has been evicted yet
+        return len(self.starts) < self.capacity or self.oldest() <= t0
+
+    def dump(self) -> bytes:
+        # Head, bucket count and the raw columns, for checkpoints
+        return RING_HEADER.pack(self.head, len(self.starts)) + b"".join(
+            getattr(self, name).tobytes() for name in COLUMNS)
+
+    def load(self, buf, off: int) -> int:
+        # Restore what dump() wrote at buf[off:]; returns the offset just past it
+        self.head, n = RING_HEADER.unpack_from(buf, off)
+        off += RING_HEADER.size
+        if n > self.capacity:
+            raise ValueError("rollup tier does not fit")
+        for name in COLUMNS:
+            column = array(getattr(self, name).typecode)
+            end = off + (n if name == "starts" else n * NF) * column.itemsize
+            if end > len(buf):
+                raise ValueError("rollup tier does not fit")
+            column.frombytes(buf[off:end])
+            setattr(self, name, column)
+            off = end
+        return off
+
+class DeviceRollups:
+    # All rollup tiers of one device, finest first. Samples come in as tuples in
+    # HISTORY_FIELDS order and are narrowed to ROLLUP_FIELDS once for all tiers.
+    __slots__ = ("tiers",)
+
+    def __init__(self, tiers):
+        self.tiers = tuple(RollupRing(step, retention) for step, retention in tiers)
+
+    def add(self, ts: int, values):
+        values = pick_fields(values)
+        for tier in self.tiers:
+            tier.add(ts, values)
+
+    def extend(self, ts: list, rows: list):
+        rows = [pick_fields(r) for r in rows]
+        for tier in self.tiers:
+            tier.extend(ts, rows)
+
+    def nbytes(self) -> int:
+        return sum(tier.nbytes() for tier in self.tiers)
+
+    def dump(self) -> bytes:
+        return b"".join(tier.dump() for tier in self.tiers)
+
+    def load(self, buf, off: int) -> int:
+        for tier in self.tiers:
+            off = tier.load(buf, off)
+        return off
+
+    def pick(self, t0: int, step: int):
+        # Coarsest tier whose buckets fit inside `step` and whose retention reaches
+        # back to t0; falls back to the longest-lived fitting tier. None means no
+        # tier is fine enough, so raw samples should be used.
+        fitting = [t for t in self.tiers if t.step <= step and len(t)]
+        for tier in reversed(fitting):
+            if step % tier.step == 0 and tier.covers(t0):
+                return tier
+        for tier in reversed(fitting):
+            if tier.covers(t0):
+                return tier
+        return fitting[-1] if fitting else None
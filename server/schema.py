@@ -0,0 +1,249 @@
+import sys
+
+from state import DeviceState
+
+# Declarative description of an agent payload. Each leaf names the DeviceState
+# attribute it fills. compile_payload() turns the description into one generated
+# function at startup, so at ingest a record is checked, coerced and flattened
+# into a DeviceState in one pass, without consulting the description again.
+# Keys not described here are ignored; null counts as absent.
+INF = float("inf")
+FLOAT_MAX = sys.float_info.max  # ints beyond it do not fit a float
+TS_MAX = (1 << 63) - 1  # stored as i64 (shared table, wire format)
+INTERVAL_MAX = 86400  # seconds; stored as u32
+COUNTER_MAX = (1 << 64) - 1  # NIC counters wrap at 32 or 64 bits
+
+def integer(attr: str, lo: int, hi: int, required: bool = False) -> dict:
+    # int, float (truncated) or a decimal string, within [lo, hi]
+    return {"kind": "integer", "attr": attr, "required": required, "lo": lo, "hi": hi}
+
+def number(attr: str, lo=None, hi=None) -> dict:
+    # Finite int or float, or a numeric string; stored as given when plainly typed,
+    # otherwise as float
+    return {"kind": "number", "attr": attr, "required": False, "lo": lo, "hi": hi}
+
+def counter(attr: str) -> dict:
+    # Integer in [0, COUNTER_MAX]; integral floats and decimal strings are converted
+    return {"kind": "counter", "attr": attr, "required": False}
+
+def text(attr: str, required: bool = False) -> dict:
+    # String (numbers are converted), interned; a required one must be non-empty
+    return {"kind": "text", "attr": attr, "required": required}
+
+def numbers(attrs: tuple, lo=None) -> dict:
+    # List of at least len(attrs) numbers, e.g. the three load averages
+    return {"kind": "numbers", "attrs": attrs, "required": False, "lo": lo}
+
+def section(fields: dict, required: bool = True) -> dict:
+    # Nested object
+    return {"kind": "section", "fields": fields, "required": required}
+
+PAYLOAD = {
+    "device_id": text("device_id", required=True),
+    "ts": integer("last_seen", 0, TS_MAX, required=True),
+    "interval": integer("interval", 1, INTERVAL_MAX),
+    "system": section({
+        "uptime_s": number("uptime_s", lo=0),
+        "cpu_pct": number("cpu_pct", lo=0, hi=100),
+        "mem_pct": number("mem_pct", lo=0, hi=100),
+        "disk_pct": number("disk_pct", lo=0, hi=100),
+        "loadavg": numbers(("loadavg_1", "loadavg_5", "loadavg_15"), lo=0),
+    }),
+    "network": section({
+        "iface": text("iface"),
+        "ip": text("ip"),
+        "mac": text("mac"),
+        "rx_bytes": counter("rx_bytes"),
+        "tx_bytes": counter("tx_bytes"),
+        "rx_packets": counter("rx_packets"),
+        "tx_packets": counter("tx_packets"),
+    }),
+}
+
+def _integer(path: str, lo: int, hi: int):
+    def coerce(v):
+        t = type(v)
+        if t is not int:
+            if t is bool or t not in (float, str):
+                raise ValueError(f"{path} must be an integer")
+            try:
+                v = int(v)
+            except (ValueError, OverflowError):
+                raise ValueError(f"{path} must be an integer") from None
+        if not lo <= v <= hi:
+            raise ValueError(f"{path} must be between {lo} and {hi}")
+        return v
+    return coerce
+
+def _number(path: str, lo, hi):
+    lo = -INF if lo is None else lo
+    hi = INF if hi is None else hi
+    def coerce(v):
+        t = type(v)
+        if t is not float:
+            if t is bool or t not in (int, str):
+                raise ValueError(f"{path} must be a number")
+            try:
+                v = float(v)
+            except ValueError:
+                raise ValueError(f"{path} must be a number") from None
+            except OverflowError:  # int too large for a float
+                raise ValueError(f"{path} must be a finite number") from None
+        if not -INF < v < INF:
+            raise ValueError(f"{path} must be a finite number")  # also NaN
+        if not lo <= v <= hi:
+            if hi == INF:
+                raise ValueError(f"{path} must be at least {lo}")
+            raise ValueError(f"{path} must be between {lo} and {hi}")
+        return v
+    return coerce
+
+def _counter(path: str):
+    def coerce(v):
+        t = type(v)
+        if t is not int:
+            if t is float and v.is_integer():
+                v = int(v)
+            elif t is str and v.isdecimal():
+                v = int(v)
+            else:
+                raise ValueError(f"{path} must be an integer between 0 and 2**64-1")
+        if not 0 <= v <= COUNTER_MAX:
+            raise ValueError(f"{path} must be an integer between 0 and 2**64-1")
+        return v
+    return coerce
+
+def _text(path: str, required: bool):
+    intern = sys.intern
+    def coerce(v):
+        t = type(v)
+        if t is not str:
+            if t is bool or t not in (int, float):
+                raise ValueError(f"{path} must be a string")
+            v = str(v)
+        if required and not v:
+            raise ValueError(f"{path} must not be empty")
+        return intern(v)
+    return coerce
+
+def _numbers(path: str, n: int, lo):
+    item = _number(path, lo, None)
+    def coerce(v):
+        if type(v) not in (list, tuple) or len(v) < n:
+            raise ValueError(f"{path} must be a list of {n} numbers")
+        return tuple(item(x) for x in v[:n])
+    return coerce
+
+def _fast_check(spec: dict) -> str:
+    # Condition (on `v`) under which a value needs the slow coercer; the common
+    # well-typed case is decided inline without a call
+    kind = spec["kind"]
+    if kind == "integer":
+        return f"type(v) is not int or not ({spec['lo']!r} <= v <= {spec['hi']!r})"
+    if kind == "number":
+        # NaN fails every comparison; an open side is bounded by FLOAT_MAX, which
+        # also keeps out inf and ints too large to become a float later
+        lo = "-FLOAT_MAX <= v" if spec["lo"] is None else f"{spec['lo']!r} <= v"
+        hi = "v <= FLOAT_MAX" if spec["hi"] is None else f"v <= {spec['hi']!r}"
+        return f"type(v) is not float and type(v) is not int or not ({lo} and {hi})"
+    if kind == "counter":
+        return "type(v) is not int or not (0 <= v <= COUNTER_MAX)"
+    if kind == "text":
+        return "type(v) is not str" + (" or not v" if spec["required"] else "")
+    raise ValueError(f"unknown field kind: {kind}")
+
+def _coercer(spec: dict, path: str):
+    kind = spec["kind"]
+    if kind == "integer":
+        return _integer(path, spec["lo"], spec["hi"])
+    if kind == "number":
+        return _number(path, spec["lo"], spec["hi"])
+    if kind == "counter":
+        return _counter(path)
+    if kind == "text":
+        return _text(path, spec["required"])
+    if kind == "numbers":
+        return _numbers(path, len(spec["attrs"]), spec["lo"])
+    raise ValueError(f"unknown field kind: {kind}")
+
+def _emit(fields: dict, obj: str, prefix: str, lines: list, env: dict, indent: str):
+    # Source lines reading `fields` out of the dict named `obj` into `st`
+    for key, spec in fields.items():
+        path = prefix + key
+        name = "c_" + path.replace(".", "_")
+        kind = spec["kind"]
+        lines.append(f"{indent}v = {obj}.get({key!r})")
+        if kind == "section":
+            sub = "o_" + path.replace(".", "_")
+            if spec["required"]:
+                lines.append(f"{indent}if v is None: raise ValueError({'missing field: ' + path!r})")
+                inner = indent
+            else:
+                lines.append(f"{indent}if v is not None:")
+                inner = indent + "    "
+            lines.append(f"{inner}if type(v) is not dict: raise ValueError({path + ' must be an object'!r})")
+            lines.append(f"{inner}{sub} = v")
+            _emit(spec["fields"], sub, path + ".", lines, env, inner)
+            continue
+        env[name] = _coercer(spec, path)
+        if spec["required"]:
+            lines.append(f"{indent}if v is None: raise ValueError({'missing field: ' + path!r})")
+            inner = indent
+        else:
+            lines.append(f"{indent}if v is not None:")
+            inner = indent + "    "
+        if kind == "numbers":
+            lines.append(f"{inner}{', '.join('st.' + a for a in spec['attrs'])} = {name}(v)")
+            continue
+        lines.append(f"{inner}if {_fast_check(spec)}: v = {name}(v)")
+        lines.append(f"{inner}st.{spec['attr']} = {'intern(v)' if kind == 'text' else 'v'}")
+
+def compile_payload(fields: dict, default_interval: int):
+    # parse(payload) -> DeviceState; raises ValueError naming the first bad field.
+    # The description is compiled to the source of a single function, with the
+    # coercers above bound in as the slow path for anything not plainly typed.
+    env = {"DeviceState": DeviceState, "intern": sys.intern, "FLOAT_MAX": FLOAT_MAX, "COUNTER_MAX": COUNTER_MAX}
+    lines = [
+        "def parse(payload):",
+        "    if type(payload) is not dict: raise ValueError('payload must be a JSON object')",
+        f"    st = DeviceState('', 0, {int(default_interval)!r})",
+    ]
+    _emit(fields, "payload", "", lines, env, "    ")
+    lines.append("    return st")
+    exec(compile("\n".join(lines), "<payload schema>", "exec"), env)
+    return env["parse"]
+
+def _leaves(fields: dict, prefix: str):
+    # (path, spec) of every non-section field
+    for key, spec in fields.items():
+        if spec["kind"] == "section":
+            yield from _leaves(spec["fields"], prefix + key + ".")
+        else:
+            yield prefix + key, spec
+
+def compile_state_check(fields: dict):
+    # check(st) -> st for a DeviceState built elsewhere (the binary wire format):
+    # the same per-field types, ranges and finiteness as compile_payload(), read from
+    # the state's attributes; raises ValueError naming the first bad field
+    env = {"FLOAT_MAX": FLOAT_MAX, "COUNTER_MAX": COUNTER_MAX}
+    lines = ["def check(st):"]
+    for path, spec in _leaves(fields, ""):
+        if spec["kind"] == "numbers":
+            each = {"kind": "number", "lo": spec["lo"], "hi": None}
+            checks = [(attr, each) for attr in spec["attrs"]]
+            env["c_" + path.replace(".", "_")] = _number(path, spec["lo"], None)
+        else:
+            checks = [(spec["attr"], spec)]
+            env["c_" + path.replace(".", "_")] = _coercer(spec, path)
+        name = "c_" + path.replace(".", "_")
+        for attr, field in checks:
+            lines.append(f"    v = st.{attr}")
+            cond = _fast_check(field)
+            if spec["required"]:
+                lines.append(f"    if v is None: raise ValueError({'missing field: ' + path!r})")
+                lines.append(f"    if {cond}: st.{attr} = {name}(v)")
+            else:
+                lines.append(f"    if v is not None and ({cond}): st.{attr} = {name}(v)")
+    lines.append("    return st")
+    exec(compile("\n".join(lines), "<state schema>", "exec"), env)
+    return env["check"]
@@ -0,0 +1,84 @@
+import os, signal, socket, sys, time
+
+from werkzeug.serving import make_server
+
+# Production entry point: one listening socket, N pre-forked worker processes, each
+# serving it with a threaded WSGI server. Workers share device state through the
+# shared-memory table in shm.py, so any worker can take any request.
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+# Every worker applies every sample to its own copy of the store (latest states,
+# history, rollups), so memory and per-sample apply work grow with WORKERS: more
+# workers spread reads and request parsing, not ingest. Kept low by default.
+WORKERS = int(os.environ.get("WORKERS", "2"))
+SHM_DEVICES = int(os.environ.get("SHM_DEVICES", "100000"))  # device slots in the shared table
+SHM_RING = int(os.environ.get("SHM_RING", "16384"))  # recent writes a lagging worker can catch up on
+
+def run_worker(server, table, sock, worker: int):
+    # Child process: serve the inherited socket until told to stop
+    def stop(signum, frame):
+        if server.WAL is not None:
+            server.WAL.sync()  # flush the group-commit buffer before going away
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.attach_worker(table, worker)
+    httpd = make_server(HOST, PORT, server.app, threaded=True, fd=sock.fileno())
+    print(f"[server] worker {worker} (pid {os.getpid()}) serving on {HOST}:{PORT}")
+    try:
+        httpd.serve_forever()
+    finally:
+        os._exit(0)
+
+def spawn(server, table, sock, worker: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        run_worker(server, table, sock, worker)
+    return pid
+
+def main():
+    # Importing the app recovers the WAL once, here in the parent, before forking
+    import app as server
+    from shm import SharedDevices
+
+    table = SharedDevices(SHM_DEVICES, SHM_RING, boot_id=server.BOOT_ID)
+    server.share_state(table)
+    sock = socket.create_server((HOST, PORT), backlog=1024)
+    sock.set_inheritable(True)
+
+    workers = {spawn(server, table, sock, i): i for i in range(WORKERS)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"[server] {WORKERS} workers on {HOST}:{PORT}, shared table of {SHM_DEVICES} devices")
+
+    # Restart workers that die; a replacement catches up from the shared table
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker = workers.pop(pid, None)
+        if worker is None or stopping:
+            continue
+        print(f"[server] worker {worker} (pid {pid}) exited with status {status}; restarting")
+        time.sleep(1.0)
+        workers[spawn(server, table, sock, worker)] = worker
+    sock.close()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
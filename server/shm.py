@@ -0,0 +1,225 @@
+import mmap, multiprocessing, struct, sys
+from array import array
+
+import rates
+from state import DeviceState
+
+# Shared header: slots in use, ring entries ever written (also the latest version),
+# boot id (each word is written on its own, under the lock that owns it)
+U64 = struct.Struct("<Q")
+HEADER = struct.Struct("<QQQ")
+# One device record: seqlock counter, version (the ring position it was written at),
+# last_seen, interval, int-valued mask, online flag, numeric fields (NaN = missing)
+# and fixed-width NUL-padded text fields
+RECORD = struct.Struct("<QQqIHBx15d256s32s64s32s")
+# A ring entry is the slot number followed by a copy of the record written there
+ENTRY = struct.Struct("<I4x")
+NUMERIC_FIELDS = (
+    "uptime_s", "cpu_pct", "mem_pct", "disk_pct",
+    "loadavg_1", "loadavg_5", "loadavg_15",
+    "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+) + rates.RATE_FIELDS
+TEXT_WIDTHS = (("iface", 32), ("ip", 64), ("mac", 32))
+DEVICE_ID_BYTES = 256
+ID_OFFSET = struct.calcsize("<QQqIHBx15d")  # where device_id starts inside a record
+ONLINE = 3  # index of the online flag among the record fields after seq and version
+NAN = float("nan")
+
+def _fit(text, width: int) -> bytes:
+    # UTF-8 bytes of `text` cut to `width` on a character boundary
+    if text is None:
+        return b""
+    data = text.encode()
+    if len(data) > width:
+        data = data[:width].decode(errors="ignore").encode()
+    return data
+
+def _decode(raw) -> tuple:
+    # (seq, version, online, DeviceState) from one packed record
+    seq, version, last_seen, interval, ints, online, *rest = RECORD.unpack(raw)
+    nums, (device_id, *texts) = rest[:len(NUMERIC_FIELDS)], rest[len(NUMERIC_FIELDS):]
+    st = DeviceState(sys.intern(device_id.rstrip(b"\0").decode()), last_seen, interval)
+    for i, (f, v) in enumerate(zip(NUMERIC_FIELDS, nums)):
+        if v == v:
+            setattr(st, f, int(v) if ints >> i & 1 else v)
+    for (f, _), v in zip(TEXT_WIDTHS, texts):
+        v = v.rstrip(b"\0")
+        if v:
+            setattr(st, f, sys.intern(v.decode()))
+    return seq, version, bool(online), st
+
+class SharedDevices:
+    # Device state shared by pre-forked workers, in one anonymous shared mmap created
+    # before the fork: a fixed-layout table holding the latest record of every device,
+    # and a ring holding a copy of each record as it is written.
+    #
+    # A writer fills a device's slot under the slot's stripe lock, bumping the slot's
+    # sequence number to odd before and even after (a seqlock), and appends the record
+    # to the ring before letting go of the stripe, so the ring keeps each device's
+    # writes in order. Workers replay the ring into their local stores; one that falls
+    # a whole ring behind resyncs from the table instead (latest state only).
+    #
+    # Every write takes the next ring position as its version, and records whether
+    # the device is online, so all workers see the same versions and the same
+    # online/offline flips (an expiry is itself a write, made once by expire()).
+    # Each process keeps its own directory (device_id -> slot), ring cursor and the
+    # sequence it last applied per slot.
+    def __init__(self, capacity: int, ring_size: int = 16384, stripes: int = 64, boot_id: int = 0):
+        self.capacity = capacity
+        self.ring_size = ring_size
+        self.entry_size = ENTRY.size + RECORD.size
+        self.ring_offset = HEADER.size
+        self.slot_offset = self.ring_offset + self.entry_size * ring_size
+        self.mm = mmap.mmap(-1, self.slot_offset + RECORD.size * capacity)  # MAP_SHARED, inherited by fork
+        self.alloc_lock = multiprocessing.Lock()
+        self.ring_lock = multiprocessing.Lock()
+        self.stripes = [multiprocessing.Lock() for _ in range(stripes)]
+        U64.pack_into(self.mm, 16, boot_id)
+        # Per-process view, copied into each worker at fork
+        self.slots = {}
+        self.known = 0
+        self.cursor = 0
+        self.seen = array("Q", bytes(8 * capacity))
+
+    def _header(self) -> tuple:
+        return HEADER.unpack_from(self.mm, 0)
+
+    @property
+    def boot_id(self) -> int:
+        return self._header()[2]
+
+    def version(self) -> int:
+        # Version of the latest write
+        return self._header()[1]
+
+    def _load_directory(self, used: int):
+        # Learn ids of slots allocated (by any process) since the last look
+        for slot in range(self.known, used):
+            off = self.slot_offset + slot * RECORD.size + ID_OFFSET
+            self.slots[sys.intern(self.mm[off:off + DEVICE_ID_BYTES].rstrip(b"\0").decode())] = slot
+        self.known = used
+
+    def slot_for(self, device_id: str) -> int:
+        # Slot of a device, allocated on first sight; ValueError when it cannot have one
+        slot = self.slots.get(device_id)
+        if slot is not None:
+            return slot
+        with self.alloc_lock:
+            used = self._header()[0]
+            self._load_directory(used)
+            slot = self.slots.get(device_id)
+            if slot is None:
+                if used >= self.capacity:
+                    raise ValueError("shared device table is full")
+                data = device_id.encode()
+                if len(data) > DEVICE_ID_BYTES:
+                    raise ValueError("device_id too long")
+                slot = used
+                RECORD.pack_into(self.mm, self.slot_offset + slot * RECORD.size, 0, 0, 0, 0, 0, 0,
+                                 *(NAN,) * len(NUMERIC_FIELDS), data, b"", b"", b"")
+                U64.pack_into(self.mm, 0, used + 1)
+                self.slots[device_id] = slot
+                self.known = used + 1
+        return slot
+
+    def _write(self, slot: int, off: int, seq: int, fields) -> int:
+        # Write one record (the fields after seq and version) to its slot and the ring;
+        # caller holds the slot's stripe lock. The ring lock is held across both, so
+        # versions are handed out in ring order.
+        with self.ring_lock:
+            total = self._header()[1]
+            raw = RECORD.pack(seq + 2, total + 1, *fields)
+            U64.pack_into(self.mm, off, seq + 1)
+            self.mm[off + U64.size:off + RECORD.size] = raw[U64.size:]
+            U64.pack_into(self.mm, off, seq + 2)
+            pos = self.ring_offset + (total % self.ring_size) * self.entry_size
+            ENTRY.pack_into(self.mm, pos, slot)
+            self.mm[pos + ENTRY.size:pos + self.entry_size] = raw
+            U64.pack_into(self.mm, 8, total + 1)
+        return total + 1
+
+    def publish(self, states, online, derive_rates: bool = True):
+        # Write each state into its slot and the ring, online(state) telling whether
+        # the device counts as online. Counter rates are derived here, against the
+        # record already in the slot, so every worker sees the same rates
+        # (derive_rates=False keeps the rates the states already carry). A state no
+        # newer than the one in the slot is skipped, like apply_state() does.
+        base = NUMERIC_FIELDS[:-len(rates.RATE_FIELDS)]
+        for st in states:
+            slot = self.slot_for(st.device_id)
+            off = self.slot_offset + slot * RECORD.size
+            texts = [_fit(getattr(st, f), w) for f, w in TEXT_WIDTHS]
+            with self.stripes[slot % len(self.stripes)]:
+                seq = U64.unpack_from(self.mm, off)[0]
+                prev = _decode(self.mm[off:off + RECORD.size])[3] if seq else None
+                if prev is not None and st.last_seen <= prev.last_seen:
+                    continue
+                if derive_rates:
+                    values = [getattr(st, f) for f in base] + list(rates.sample_rates(prev, st))
+                else:
+                    values = [getattr(st, f) for f in NUMERIC_FIELDS]
+                nums, ints = [], 0
+                for i, v in enumerate(values):
+                    if isinstance(v, int):
+                        ints |= 1 << i
+                    nums.append(NAN if v is None else v)
+                self._write(slot, off, seq, (st.last_seen, st.interval, ints, 1 if online(st) else 0,
+                                             *nums, st.device_id.encode(), *texts))
+
+    def expire(self, device_id: str, last_seen: int) -> bool:
+        # Mark a device offline if it is still online with the sample seen at
+        # `last_seen`; False when another worker got there first or it reported since
+        slot = self.slots.get(device_id)
+        if slot is None:
+            return False
+        off = self.slot_offset + slot * RECORD.size
+        with self.stripes[slot % len(self.stripes)]:
+            seq, _, *fields = RECORD.unpack_from(self.mm, off)
+            if not fields[ONLINE] or fields[0] != last_seen:
+                return False
+            fields[ONLINE] = 0
+            self._write(slot, off, seq, fields)
+        return True
+
+    def read(self, slot: int) -> tuple:
+        # (seq, version, online, DeviceState) from a consistent copy of one slot
+        off = self.slot_offset + slot * RECORD.size
+        while True:
+            raw = self.mm[off:off + RECORD.size]
+            seq = U64.unpack_from(raw)[0]
+            if seq & 1 == 0 and U64.unpack_from(self.mm, off)[0] == seq:
+                return _decode(raw)
+
+    def changes(self) -> list:
+        # (version, online, DeviceState) written since this process last asked, in
+        # version order
+        used, total = self._header()[:2]
+        if used > self.known:
+            self._load_directory(used)
+        if total == self.cursor:
+            return []
+        entries = None
+        if total - self.cursor < self.ring_size:
+            size, n, base = self.ring_size, self.entry_size, self.ring_offset
+            entries = [self.mm[base + (i % size) * n:base + (i % size + 1) * n]
+                       for i in range(self.cursor, total)]
+            if self._header()[1] - self.cursor >= size:
+                entries = None  # lapped while copying
+        out = []
+        if entries is None:
+            # Too far behind: compare every slot's sequence against what was applied
+            for slot in range(used):
+                seq, version, online, st = self.read(slot)
+                if seq != self.seen[slot] and version <= total:
+                    self.seen[slot] = seq
+                    out.append((version, online, st))
+            out.sort(key=lambda change: change[0])
+        else:
+            for entry in entries:
+                slot = ENTRY.unpack_from(entry)[0]
+                seq, version, online, st = _decode(entry[ENTRY.size:])
+                if seq > self.seen[slot]:  # not already taken in by a resync
+                    self.seen[slot] = seq
+                    out.append((version, online, st))
+        self.cursor = total
+        return out
@@ -0,0 +1,60 @@
+import threading
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight:
+    # Runs at most one computation per key at a time: callers arriving while one is
+    # in flight wait for it and share its result (or its exception) instead of
+    # repeating the work. Nothing is kept once the call finishes, so a later caller
+    # always computes afresh. Counters are kept per group for the coalescing ratio.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counts = {}  # group -> [requests, coalesced]
+
+    def do(self, group: str, key, compute):
+        with self._lock:
+            counts = self._counts.setdefault(group, [0, 0])
+            counts[0] += 1
+            call = self._calls.get((group, key))
+            if call is None:
+                call = self._calls[(group, key)] = _Call()
+                leader = True
+            else:
+                counts[1] += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[(group, key)]
+            call.done.set()
+        return call.value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                group: {
+                    "requests": requests,
+                    "coalesced": coalesced,
+                    "hit_ratio": round(coalesced / requests, 4) if requests else 0.0,
+                }
+                for group, (requests, coalesced) in self._counts.items()
+            }
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,104 @@
+import math
+
+class LogHistogram:
+    # HDR-style log-linear histogram: each power of two is split into SUB linear
+    # sub-buckets, so a reported quantile is within 1/(2*SUB) (~0.8%) of a real
+    # value. Counts live in a sparse dict; add/remove are O(1), quantiles walk the
+    # occupied buckets (a few hundred at most for metric ranges), and histograms
+    # with the same SUB merge by adding counts.
+    SUB = 64
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = {}  # bucket -> count; bucket None holds values <= 0
+        self.total = 0
+
+    @classmethod
+    def bucket(cls, v: float):
+        if v <= 0:
+            return None
+        m, e = math.frexp(v)  # v = m * 2**e, 0.5 <= m < 1
+        return e * cls.SUB + int((m - 0.5) * 2 * cls.SUB)
+
+    @classmethod
+    def value_of(cls, b) -> float:
+        # Midpoint of a bucket
+        if b is None:
+            return 0.0
+        e, s = divmod(b, cls.SUB)
+        return math.ldexp(0.5 + (s + 0.5) / (2 * cls.SUB), e)
+
+    def add(self, v: float, n: int = 1):
+        b = self.bucket(v)
+        self.counts[b] = self.counts.get(b, 0) + n
+        self.total += n
+
+    def remove(self, v: float, n: int = 1):
+        b = self.bucket(v)
+        left = self.counts.get(b, 0) - n
+        if left > 0:
+            self.counts[b] = left
+        else:
+            self.counts.pop(b, None)
+        self.total -= n
+
+    def merge(self, other: "LogHistogram"):
+        for b, n in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + n
+        self.total += other.total
+
+    def quantiles(self, qs) -> list:
+        # Nearest-rank estimate for each q in [0, 1]; None when empty
+        if self.total <= 0:
+            return [None for _ in qs]
+        order = sorted(self.counts, key=lambda b: -math.inf if b is None else b)
+        targets = sorted((max(1, math.ceil(q * self.total)), i) for i, q in enumerate(qs))
+        out = [None] * len(qs)
+        seen, k = 0, 0
+        for b in order:
+            seen += self.counts[b]
+            while k < len(targets) and targets[k][0] <= seen:
+                out[targets[k][1]] = self.value_of(b)
+                k += 1
+            if k == len(targets):
+                break
+        return out
+
+class FleetQuantiles:
+    # One LogHistogram per (metric, group) plus a fleet-wide one per metric, over
+    # the latest values of online devices. Maintained with add()/remove() exactly
+    # like FleetSummary, so a device contributes one value per metric.
+    def __init__(self, fields, group_of):
+        self.fields = tuple(fields)
+        self.group_of = group_of
+        self.fleet = {f: LogHistogram() for f in self.fields}
+        self.groups = {}  # group -> {field: LogHistogram}
+
+    def _apply(self, st, sign: int):
+        group = self.group_of(st.device_id)
+        hists = self.groups.get(group)
+        if hists is None:
+            hists = self.groups[group] = {f: LogHistogram() for f in self.fields}
+        for f in self.fields:
+            v = getattr(st, f)
+            if v is None:
+                continue
+            if sign > 0:
+                self.fleet[f].add(v)
+                hists[f].add(v)
+            else:
+                self.fleet[f].remove(v)
+                hists[f].remove(v)
+
+    def add(self, st):
+        self._apply(st, 1)
+
+    def remove(self, st):
+        self._apply(st, -1)
+
+    def histogram(self, field: str, group: str = None):
+        # Fleet (group None) or per-group histogram; None for an unknown group
+        if group is None:
+            return self.fleet[field]
+        hists = self.groups.get(group)
+        return hists[field] if hists is not None else None
@@ -0,0 +1,58 @@
+import threading, time
+
+_MISSING = object()
+
+class Snapshot:
+    # Immutable view of the fleet: the latest states in id order as of `key`
+    # (version, status epoch), captured at wall-clock second `now`. Anything built
+    # from it (rows, serialized bodies) is memoized on the snapshot, so every reader
+    # holding the same snapshot shares one copy.
+    __slots__ = ("key", "now", "taken", "states", "_lock", "_memo")
+
+    def __init__(self, key, now: int, states):
+        self.key = key
+        self.now = now
+        self.taken = time.monotonic()
+        self.states = tuple(states)
+        self._lock = threading.Lock()
+        self._memo = {}
+
+    def memo(self, name, build):
+        # build(self) at most once per snapshot and name; concurrent callers wait for it
+        value = self._memo.get(name, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            value = self._memo.get(name, _MISSING)
+            if value is _MISSING:
+                value = self._memo[name] = build(self)
+            return value
+
+class SnapshotPublisher:
+    # Hands out the current Snapshot. A new one is captured when the state key has
+    # moved and the current one is at least `interval` seconds old, or when it is
+    # older than `max_age` (so time-derived fields such as ages do not go stale).
+    # Publishing is a plain reference swap; while one reader captures the next
+    # snapshot, the others keep getting the previous one instead of waiting.
+    def __init__(self, capture, key, interval: float, max_age: float):
+        self.capture = capture  # () -> Snapshot
+        self.key = key          # () -> current state key, read without locking
+        self.interval = interval
+        self.max_age = max_age
+        self._current = None
+        self._publishing = threading.Lock()
+
+    def current(self) -> Snapshot:
+        snap = self._current
+        if snap is not None:
+            age = time.monotonic() - snap.taken
+            if age < self.max_age and (age < self.interval or snap.key == self.key()):
+                return snap
+        if not self._publishing.acquire(blocking=snap is None):
+            return snap
+        try:
+            if self._current is snap:
+                self._current = self.capture()
+            return self._current
+        finally:
+            self._publishing.release()
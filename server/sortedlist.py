@@ -0,0 +1,144 @@
+from bisect import bisect_left, bisect_right, insort
+
+class SortedList:
+    # Sorted sequence stored as a list of short sorted blocks plus each block's max.
+    # add/remove bisect the block maxes, then insert into one block of at most
+    # 2 * LOAD items, so updates stay cheap at 100k+ entries where one flat list
+    # would shift the whole array on every insert.
+    LOAD = 256
+
+    def __init__(self, values=()):
+        self._blocks = []
+        self._maxes = []
+        self._len = 0
+        for v in sorted(values):
+            self._append(v)
+
+    def _append(self, v):
+        if not self._blocks or len(self._blocks[-1]) >= self.LOAD:
+            self._blocks.append([v])
+            self._maxes.append(v)
+        else:
+            self._blocks[-1].append(v)
+            self._maxes[-1] = v
+        self._len += 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __reversed__(self):
+        for block in reversed(self._blocks):
+            yield from reversed(block)
+
+    def __contains__(self, v) -> bool:
+        i = bisect_left(self._maxes, v)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, v)
+        return j < len(block) and block[j] == v
+
+    def add(self, v):
+        if not self._blocks:
+            self._append(v)
+            return
+        i = bisect_left(self._maxes, v)
+        if i == len(self._blocks):
+            i -= 1
+            self._blocks[i].append(v)
+            self._maxes[i] = v
+        else:
+            insort(self._blocks[i], v)
+        self._len += 1
+        block = self._blocks[i]
+        if len(block) > 2 * self.LOAD:
+            # Split an oversized block in two
+            self._blocks.insert(i + 1, block[self.LOAD:])
+            del block[self.LOAD:]
+            self._maxes[i] = block[-1]
+            self._maxes.insert(i + 1, self._blocks[i + 1][-1])
+
+    def discard(self, v) -> bool:
+        i = bisect_left(self._maxes, v)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, v)
+        if j == len(block) or block[j] != v:
+            return False
+        del block[j]
+        self._len -= 1
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+        return True
+
+    def remove(self, v):
+        if not self.discard(v):
+            raise ValueError(f"{v!r} not in list")
+
+    def first(self):
+        return self._blocks[0][0] if self._blocks else None
+
+    def last(self):
+        return self._blocks[-1][-1] if self._blocks else None
+
+    def irange(self, minimum=None, maximum=None, reverse=False, inclusive=(True, True)):
+        # Values between minimum and maximum (either may be None for unbounded),
+        # ascending or descending; cost is O(log n) to start plus O(1) per item
+        blocks, maxes = self._blocks, self._maxes
+        if not blocks:
+            return
+        lo_incl, hi_incl = inclusive
+        if not reverse:
+            if minimum is None:
+                i, j = 0, 0
+            else:
+                i = (bisect_left if lo_incl else bisect_right)(maxes, minimum)
+                if i == len(blocks):
+                    return
+                j = (bisect_left if lo_incl else bisect_right)(blocks[i], minimum)
+            while i < len(blocks):
+                block = blocks[i]
+                while j < len(block):
+                    v = block[j]
+                    if maximum is not None and (v > maximum or (v == maximum and not hi_incl)):
+                        return
+                    yield v
+                    j += 1
+                i, j = i + 1, 0
+        else:
+            if maximum is None:
+                i = len(blocks) - 1
+                j = len(blocks[i]) - 1
+            else:
+                i = (bisect_right if hi_incl else bisect_left)(maxes, maximum)
+                if i == len(blocks):
+                    i -= 1
+                    j = len(blocks[i]) - 1
+                else:
+                    j = (bisect_right if hi_incl else bisect_left)(blocks[i], maximum) - 1
+            while i >= 0:
+                block = blocks[i]
+                while j >= 0:
+                    v = block[j]
+                    if minimum is not None and (v < minimum or (v == minimum and not lo_incl)):
+                        return
+                    yield v
+                    j -= 1
+                i -= 1
+                if i >= 0:
+                    j = len(blocks[i]) - 1
+
+    def prefix(self, prefix: str):
+        # Strings starting with `prefix`, ascending
+        for v in self.irange(minimum=prefix):
+            if not v.startswith(prefix):
+                return
+            yield v
@@ -0,0 +1,69 @@
+import json, sys
+
+class DeviceState:
+    # Latest state of one device, flattened from the agent payload once at ingest
+    # (by the compiled schema in schema.py, or wire.decode() for binary records).
+    # Slotted so 100k devices cost a fixed handful of pointers each instead of
+    # the nested system/network dicts of the raw payload.
+    __slots__ = (
+        "device_id", "last_seen", "interval",
+        "uptime_s", "cpu_pct", "mem_pct", "disk_pct",
+        "loadavg_1", "loadavg_5", "loadavg_15",
+        "iface", "ip", "mac",
+        "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+        "rx_bytes_ps", "tx_bytes_ps", "rx_packets_ps", "tx_packets_ps",
+        "version", "fragment",
+    )
+
+    def __init__(self, device_id: str, last_seen: int, interval: int):
+        self.device_id = device_id
+        self.last_seen = last_seen
+        self.interval = interval
+        self.uptime_s = self.cpu_pct = self.mem_pct = self.disk_pct = None
+        self.loadavg_1 = self.loadavg_5 = self.loadavg_15 = None
+        self.iface = self.ip = self.mac = None
+        self.rx_bytes = self.tx_bytes = self.rx_packets = self.tx_packets = None
+        # Per-second counter rates, derived from the previous sample when applied
+        self.rx_bytes_ps = self.tx_bytes_ps = self.rx_packets_ps = self.tx_packets_ps = None
+        self.version = 0  # change counter stamped by the server when applied
+        self.fragment = b""  # pre-serialized dashboard row, set when applied
+
+    # Fields persisted in the write-ahead log, in record order (rates are re-derived on replay)
+    RECORD_FIELDS = (
+        "device_id", "last_seen", "interval",
+        "uptime_s", "cpu_pct", "mem_pct", "disk_pct",
+        "loadavg_1", "loadavg_5", "loadavg_15",
+        "iface", "ip", "mac",
+        "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+    )
+
+    def to_record(self) -> bytes:
+        # Compact JSON array of RECORD_FIELDS
+        return json.dumps([getattr(self, k) for k in self.RECORD_FIELDS], separators=(",", ":")).encode()
+
+    @classmethod
+    def from_record(cls, data: bytes) -> "DeviceState":
+        st = cls.__new__(cls)
+        for k, v in zip(cls.RECORD_FIELDS, json.loads(data)):
+            setattr(st, k, sys.intern(v) if isinstance(v, str) else v)
+        st.rx_bytes_ps = st.tx_bytes_ps = st.rx_packets_ps = st.tx_packets_ps = None
+        st.version = 0
+        st.fragment = b""
+        return st
+
+    @property
+    def loadavg(self):
+        # [1m, 5m, 15m] as sent by the agent, or None if it sent none
+        if self.loadavg_1 is None and self.loadavg_5 is None and self.loadavg_15 is None:
+            return None
+        return [self.loadavg_1, self.loadavg_5, self.loadavg_15]
+
+    def sample(self) -> tuple:
+        # Numeric fields in history.HISTORY_FIELDS order
+        return (
+            self.cpu_pct, self.mem_pct, self.disk_pct,
+            self.loadavg_1, self.loadavg_5, self.loadavg_15,
+            self.rx_bytes, self.tx_bytes, self.rx_packets, self.tx_packets,
+            self.rx_bytes_ps, self.tx_bytes_ps, self.rx_packets_ps, self.tx_packets_ps,
+            self.uptime_s,
+        )
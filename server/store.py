@@ -0,0 +1,80 @@
+import threading
+
+from history import DeviceHistory
+from rollup import DeviceRollups
+
+class Stripe:
+    # One shard of the store: its lock and the devices that hash to it
+    __slots__ = ("lock", "states", "history", "rollups")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}   # device_id -> latest DeviceState
+        self.history = {}  # device_id -> DeviceHistory
+        self.rollups = {}  # device_id -> DeviceRollups
+
+class DeviceStore:
+    # Per-device state (latest DeviceState, history ring, rollups) sharded by a hash
+    # of the device id into lock stripes, so writers for different devices do their
+    # per-device work in parallel. A stored DeviceState is never modified again
+    # (each sample is a new object), so a list of states taken under the locks is a
+    # consistent snapshot that can be serialized after they are released.
+    def __init__(self, stripes: int, history_capacity: int, rollup_tiers):
+        self.stripes = tuple(Stripe() for _ in range(max(1, stripes)))
+        self.history_capacity = history_capacity
+        self.rollup_tiers = rollup_tiers
+
+    def stripe(self, device_id: str) -> Stripe:
+        return self.stripes[hash(device_id) % len(self.stripes)]
+
+    def get(self, device_id: str):
+        # Latest state or None; a single dict read, safe without the stripe lock
+        return self.stripe(device_id).states.get(device_id)
+
+    def __len__(self) -> int:
+        return sum(len(s.states) for s in self.stripes)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self.stripe(device_id).states
+
+    def values(self) -> list:
+        # Every latest state, one stripe at a time (takes the stripe locks, so not
+        # to be called under app.APPLY_LOCK)
+        out = []
+        for s in self.stripes:
+            with s.lock:
+                out.extend(s.states.values())
+        return out
+
+    def append_sample(self, stripe: Stripe, state) -> bool:
+        # Fold a sample into history and rollups (caller holds stripe.lock)
+        hist = stripe.history.get(state.device_id)
+        if hist is None:
+            hist = stripe.history[state.device_id] = DeviceHistory(self.history_capacity)
+            stripe.rollups[state.device_id] = DeviceRollups(self.rollup_tiers)
+        sample = state.sample()
+        if not hist.append(state.last_seen, sample):
+            return False
+        stripe.rollups[state.device_id].add(state.last_seen, sample)
+        return True
+
+    def extend_samples(self, stripe: Stripe, device_id: str, ts: list, rows: list) -> int:
+        # Fold many samples of one device (increasing ts) into history and rollups at
+        # once, for bulk loads; returns how many were new (caller holds stripe.lock)
+        hist = stripe.history.get(device_id)
+        if hist is None:
+            hist = stripe.history[device_id] = DeviceHistory(self.history_capacity)
+            stripe.rollups[device_id] = DeviceRollups(self.rollup_tiers)
+        kept = hist.extend(ts, rows)
+        if kept:
+            stripe.rollups[device_id].extend(ts[-kept:], rows[-kept:])
+        return kept
+
+    def read_history(self, device_id: str, read):
+        # read(history, rollups) under the device's stripe lock; None for an unknown device
+        s = self.stripe(device_id)
+        with s.lock:
+            hist = s.history.get(device_id)
+            if hist is None:
+                return None
+            return read(hist, s.rollups[device_id])
@@ -0,0 +1,71 @@
+import threading, time
+from collections import deque
+
+class Broadcaster:
+    # Fan-out of Server-Sent Events: one producer thread, many subscribers.
+    # Every `tick` seconds the producer is asked for at most one event, which is
+    # encoded once and kept in a short shared backlog that all open streams read.
+    def __init__(self, produce, tick: float = 1.0, backlog: int = 64, keepalive: float = 15.0,
+                 on_start=None):
+        self.produce = produce  # (has_subscribers) -> (event name, data bytes) or None
+        self.on_start = on_start  # called before the first subscriber's catch-up
+        self.tick = tick
+        self.keepalive = keepalive
+        self.subscribers = 0
+        self._events = deque(maxlen=backlog)
+        self._seq = 0  # sequence number of the newest event
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                event = self.produce(self.subscribers > 0)
+            except Exception as e:
+                print(f"[server] stream producer error: {e}")
+                continue
+            if event is None:
+                continue
+            frame = self.frame(*event)
+            with self._cond:
+                self._seq += 1
+                self._events.append(frame)
+                self._cond.notify_all()
+
+    def subscribe(self, first=b""):
+        # Generator of SSE frames for one client, starting with `first`. A callable
+        # `first` is called once the client is registered, so a catch-up built by it
+        # cannot miss an event produced while it was being built.
+        with self._cond:
+            if self._thread is None:
+                if self.on_start is not None:
+                    self.on_start()
+                self._thread = threading.Thread(target=self._run, name="sse-producer", daemon=True)
+                self._thread.start()
+            self.subscribers += 1
+            seq = self._seq
+        try:
+            if callable(first):
+                first = first()
+            if first:
+                yield first
+            while True:
+                with self._cond:
+                    if self._seq == seq:
+                        self._cond.wait(self.keepalive)
+                    missed = self._seq - seq
+                    if missed > len(self._events):
+                        frames = [b"event: reset\ndata: {}\n\n"]  # fell behind the backlog
+                    else:
+                        frames = list(self._events)[len(self._events) - missed:] if missed else []
+                    seq = self._seq
+                yield b"".join(frames) if frames else b": keepalive\n\n"
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+    @staticmethod
+    def frame(name: str, data: bytes) -> bytes:
+        # `data` must be single-line (compact JSON)
+        return b"event: " + name.encode() + b"\ndata: " + data + b"\n\n"
@@ -0,0 +1,60 @@
+from sortedlist import SortedList
+
+def parse_thresholds(spec: str) -> dict:
+    # "cpu_pct:90,disk_pct:95" -> {"cpu_pct": 90.0, "disk_pct": 95.0}
+    out = {}
+    for part in spec.split(","):
+        if part.strip():
+            field, _, value = part.partition(":")
+            out[field.strip()] = float(value)
+    return out
+
+class FleetSummary:
+    # Running aggregates over the latest values of online devices.
+    # add()/remove() are called as devices report or change status; count/sum and
+    # the over-threshold tallies are plain counters and min/max read the ends of a
+    # sorted multiset, so snapshot() costs the same for 10 or 100k devices.
+    def __init__(self, fields, thresholds: dict):
+        self.fields = tuple(fields)
+        self.thresholds = {f: thresholds[f] for f in self.fields if f in thresholds}
+        self.count = {f: 0 for f in self.fields}
+        self.sum = {f: 0.0 for f in self.fields}
+        self.values = {f: SortedList() for f in self.fields}
+        self.over = {f: 0 for f in self.thresholds}
+
+    def _apply(self, st, sign: int):
+        for f in self.fields:
+            v = getattr(st, f)
+            if v is None:
+                continue
+            self.count[f] += sign
+            self.sum[f] += sign * v
+            if sign > 0:
+                self.values[f].add(v)
+            else:
+                self.values[f].discard(v)
+            limit = self.thresholds.get(f)
+            if limit is not None and v > limit:
+                self.over[f] += sign
+
+    def add(self, st):
+        self._apply(st, 1)
+
+    def remove(self, st):
+        self._apply(st, -1)
+
+    def snapshot(self) -> dict:
+        out = {}
+        for f in self.fields:
+            n = self.count[f]
+            m = {
+                "count": n,
+                "sum": round(self.sum[f], 6),
+                "avg": round(self.sum[f] / n, 3) if n else None,
+                "min": self.values[f].first(),
+                "max": self.values[f].last(),
+            }
+            if f in self.thresholds:
+                m["over"] = {"threshold": self.thresholds[f], "count": self.over[f]}
+            out[f] = m
+        return out
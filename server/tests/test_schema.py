@@ -0,0 +1,90 @@
+import os, sys, unittest
+
+# Runs from a checkout: python -m pytest server/tests, or python -m unittest discover server/tests
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE)]
+
+import schema
+from state import DeviceState
+
+HUGE = 10 ** 400  # valid JSON, too large for a float
+
+def payload(system=None, **overrides) -> dict:
+    p = {
+        "device_id": "site-1-0001", "ts": 1700000000, "interval": 10,
+        "system": {"uptime_s": 12345.6, "cpu_pct": 12.5, "mem_pct": 40.25, "disk_pct": 71.0,
+                   "loadavg": [0.5, 0.25, 0.125], **(system or {})},
+        "network": {"iface": "eth0", "rx_bytes": 1000},
+    }
+    p.update(overrides)
+    return p
+
+def state(**values) -> DeviceState:
+    st = DeviceState("site-1-0001", 1700000000, 10)
+    for k, v in values.items():
+        setattr(st, k, v)
+    return st
+
+class ParseTest(unittest.TestCase):
+    parse = staticmethod(schema.compile_payload(schema.PAYLOAD, 10))
+
+    def rejects(self, message, p):
+        with self.assertRaises(ValueError) as cm:
+            self.parse(p)
+        self.assertEqual(str(cm.exception), message)
+
+    def test_plain_payload(self):
+        st = self.parse(payload())
+        self.assertEqual((st.device_id, st.last_seen, st.uptime_s, st.loadavg_15, st.rx_bytes),
+                         ("site-1-0001", 1700000000, 12345.6, 0.125, 1000))
+
+    def test_oversized_int(self):
+        self.rejects("system.uptime_s must be a finite number", payload({"uptime_s": HUGE}))
+        self.rejects("system.uptime_s must be a finite number", payload({"uptime_s": -HUGE}))
+        self.rejects("system.loadavg must be a finite number", payload({"loadavg": [0.5, HUGE, 0.1]}))
+        self.rejects("system.cpu_pct must be a finite number", payload({"cpu_pct": HUGE}))
+        self.rejects("ts must be between 0 and 9223372036854775807", payload(ts=HUGE))
+        self.rejects("interval must be between 1 and 86400", payload(interval=HUGE))
+
+    def test_large_int_that_fits(self):
+        st = self.parse(payload({"uptime_s": 10 ** 300, "loadavg": [2 ** 1000, 0, 0]}))
+        self.assertEqual((st.uptime_s, st.loadavg_1), (10 ** 300, 2 ** 1000))
+        self.assertEqual(float(st.uptime_s), 1e300)
+
+    def test_nan_and_inf(self):
+        for bad in (float("nan"), float("inf"), -float("inf"), "nan", "inf", "-Infinity", "1e999"):
+            self.rejects("system.uptime_s must be a finite number", payload({"uptime_s": bad}))
+            self.rejects("system.loadavg must be a finite number", payload({"loadavg": [bad, 0, 0]}))
+        self.rejects("system.mem_pct must be a finite number", payload({"mem_pct": float("nan")}))
+
+    def test_strings_and_bools(self):
+        st = self.parse(payload({"cpu_pct": "12.5", "uptime_s": 7}))
+        self.assertEqual((st.cpu_pct, st.uptime_s), (12.5, 7))
+        self.rejects("system.cpu_pct must be a number", payload({"cpu_pct": True}))
+        self.rejects("system.cpu_pct must be a number", payload({"cpu_pct": "lots"}))
+
+class StateCheckTest(unittest.TestCase):
+    check = staticmethod(schema.compile_state_check(schema.PAYLOAD))
+
+    def rejects(self, message, st):
+        with self.assertRaises(ValueError) as cm:
+            self.check(st)
+        self.assertEqual(str(cm.exception), message)
+
+    def test_plain_state(self):
+        st = state(uptime_s=5.0, cpu_pct=1.0, loadavg_1=0.5, rx_bytes=10)
+        self.assertIs(self.check(st), st)
+
+    def test_oversized_int(self):
+        self.rejects("system.uptime_s must be a finite number", state(uptime_s=HUGE))
+        self.rejects("system.loadavg must be a finite number", state(loadavg_15=HUGE))
+        self.rejects("network.rx_bytes must be an integer between 0 and 2**64-1", state(rx_bytes=HUGE))
+
+    def test_nan_and_inf(self):
+        for bad in (float("nan"), float("inf"), -float("inf")):
+            self.rejects("system.uptime_s must be a finite number", state(uptime_s=bad))
+            self.rejects("system.loadavg must be a finite number", state(loadavg_5=bad))
+            self.rejects("system.disk_pct must be a finite number", state(disk_pct=bad))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os, sys, unittest
+
+# Runs from a checkout: python -m pytest server/tests, or python -m unittest discover server/tests
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.dirname(HERE), os.path.join(os.path.dirname(os.path.dirname(HERE)), "agent")]
+
+import agent
+import wire
+
+def payload(**overrides) -> dict:
+    # A full agent sample, as collect() builds it
+    p = {
+        "device_id": "site-1-0001", "ts": 1700000000, "interval": 10,
+        "system": {"uptime_s": 12345.6, "cpu_pct": 12.5, "mem_pct": 40.25, "disk_pct": 71.0,
+                   "loadavg": [0.5, 0.25, 0.125]},
+        "network": {"iface": "eth0", "ip": "10.0.0.7", "mac": "aa:bb:cc:dd:ee:ff",
+                    "rx_bytes": 2**40 + 1, "tx_bytes": 123456789, "rx_packets": 1000, "tx_packets": 2**64 - 1},
+    }
+    p.update(overrides)
+    return p
+
+class RoundTripTest(unittest.TestCase):
+    def decode_one(self, data: bytes):
+        states, err = wire.decode(data, 10)
+        self.assertIsNone(err)
+        self.assertEqual(len(states), 1)
+        return states[0]
+
+    def test_agent_matches_server_encoder(self):
+        for p in (payload(), payload(system={}, network={}), payload(interval=60),
+                  payload(network={"iface": None, "rx_bytes": 0})):
+            self.assertEqual(agent.encode_binary(p), wire.encode(p))
+
+    def test_all_fields(self):
+        p = payload()
+        st = self.decode_one(agent.encode_binary(p))
+        self.assertEqual((st.device_id, st.last_seen, st.interval), ("site-1-0001", 1700000000, 10))
+        for name in ("uptime_s", "cpu_pct", "mem_pct", "disk_pct"):
+            self.assertEqual(getattr(st, name), p["system"][name])
+        self.assertEqual([st.loadavg_1, st.loadavg_5, st.loadavg_15], p["system"]["loadavg"])
+        for name in ("iface", "ip", "mac", "rx_bytes", "tx_bytes", "rx_packets", "tx_packets"):
+            self.assertEqual(getattr(st, name), p["network"][name])
+
+    def test_missing_fields(self):
+        p = payload(system={"cpu_pct": 3.0}, network={"tx_packets": 5})
+        del p["interval"]
+        st = self.decode_one(agent.encode_binary(p))
+        self.assertEqual(st.interval, 10)  # the default passed to decode()
+        self.assertEqual((st.cpu_pct, st.tx_packets), (3.0, 5))
+        for name in ("uptime_s", "mem_pct", "disk_pct", "loadavg_1", "loadavg_5", "loadavg_15",
+                     "rx_bytes", "tx_bytes", "rx_packets"):
+            self.assertIsNone(getattr(st, name), name)
+        self.assertEqual((st.iface, st.ip, st.mac), ("", "", ""))
+
+    def test_zero_is_not_missing(self):
+        st = self.decode_one(agent.encode_binary(payload(system={"cpu_pct": 0.0, "loadavg": [0, 0, 0]})))
+        self.assertEqual((st.cpu_pct, st.loadavg_15), (0.0, 0.0))
+
+    def test_long_text_cut_on_character_boundary(self):
+        p = payload(device_id="é" * 200)  # 400 bytes of UTF-8
+        data = agent.encode_binary(p)
+        self.assertEqual(data, wire.encode(p))
+        self.assertEqual(self.decode_one(data).device_id, "é" * 127)
+
+    def test_concatenated_records(self):
+        data = b"".join(agent.encode_binary(payload(device_id=f"d-{i}", ts=1700000000 + i)) for i in range(3))
+        states, err = wire.decode(data, 10)
+        self.assertIsNone(err)
+        self.assertEqual([(st.device_id, st.last_seen) for st in states],
+                         [("d-0", 1700000000), ("d-1", 1700000001), ("d-2", 1700000002)])
+
+    def test_truncated_records(self):
+        first = agent.encode_binary(payload(device_id="d-0"))
+        data = first + agent.encode_binary(payload(device_id="d-1"))
+        for cut in range(1, len(data)):
+            states, err = wire.decode(data[:cut], 10)
+            if cut == len(first):
+                self.assertIsNone(err)
+            else:
+                self.assertEqual(err, "truncated record", cut)
+            self.assertEqual([st.device_id for st in states], ["d-0"] if cut >= len(first) else [])
+
+    def test_rejects_bad_records(self):
+        good = agent.encode_binary(payload())
+        self.assertIn("unsupported record", wire.decode(b"XX" + good[2:], 10)[1])
+        self.assertIn("unsupported record", wire.decode(good[:2] + b"\x02" + good[3:], 10)[1])
+        self.assertEqual(wire.decode(agent.encode_binary(payload(device_id="")), 10)[1],
+                         "missing field: device_id")
+        bad_utf8 = good[:wire.HEADER.size] + b"\x02\xc3\x28" + good[wire.HEADER.size + 1 + len("site-1-0001"):]
+        self.assertEqual(wire.decode(bad_utf8, 10)[1], "invalid UTF-8 string")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+class TimerWheel:
+    # Hashed timing wheel with one-second slots.
+    # arm()/cancel() are O(1); advance() visits one slot per elapsed second and
+    # fires keys whose deadline has passed. Deadlines further out than the wheel
+    # span stay in their slot until a later lap reaches them.
+    def __init__(self, now: int, slots: int = 4096):
+        self.size = slots
+        self.now = now  # last second processed
+        self._slots = {}     # slot -> set of keys
+        self._deadline = {}  # key -> (deadline, slot); fires once now >= deadline
+
+    def __len__(self) -> int:
+        return len(self._deadline)
+
+    def __contains__(self, key) -> bool:
+        return key in self._deadline
+
+    def arm(self, key, deadline: int):
+        # (Re)schedule `key`; an already passed deadline fires on the next advance
+        self.cancel(key)
+        slot = max(deadline, self.now + 1) % self.size
+        self._deadline[key] = (deadline, slot)
+        self._slots.setdefault(slot, set()).add(key)
+
+    def cancel(self, key):
+        entry = self._deadline.pop(key, None)
+        if entry is None:
+            return
+        keys = self._slots[entry[1]]
+        keys.discard(key)
+        if not keys:
+            del self._slots[entry[1]]
+
+    def advance(self, now: int) -> list:
+        # Move to `now` and return the keys that expired, in deadline order
+        fired = []
+        if now <= self.now:
+            return fired
+        if now - self.now >= self.size:
+            seconds = range(self.size)  # a full lap or more: every slot is due
+        else:
+            seconds = range(self.now + 1, now + 1)
+        for t in seconds:
+            slot = t % self.size
+            keys = self._slots.get(slot)
+            if not keys:
+                continue
+            for key in list(keys):
+                deadline = self._deadline[key][0]
+                if deadline <= now:
+                    keys.discard(key)
+                    del self._deadline[key]
+                    fired.append((deadline, key))
+            if not keys:
+                del self._slots[slot]
+        self.now = now
+        fired.sort()
+        return [key for _, key in fired]
@@ -0,0 +1,74 @@
+import struct, sys
+
+from state import DeviceState
+
+# Binary agent payload, version 1 (little-endian), records concatenated back to back:
+#   magic "IM", version u8, presence flags u16 (bit i = NUMERIC_FIELDS[i] sent),
+#   ts i64, interval u32, 7 × f64 (uptime, cpu, mem, disk, loadavg 1/5/15),
+#   4 × u64 (rx/tx bytes, rx/tx packets),
+#   then device_id, iface, ip, mac as u8 length + UTF-8 bytes (cut to 255 bytes
+#   on a character boundary).
+# agent.py has its own copy of the encoder; tests/test_wire.py keeps them identical.
+CONTENT_TYPE = "application/x-iot-metrics"
+MAGIC = b"IM"
+VERSION = 1
+HEADER = struct.Struct("<2sBHqI7d4Q")
+NUMERIC_FIELDS = (
+    "uptime_s", "cpu_pct", "mem_pct", "disk_pct",
+    "loadavg_1", "loadavg_5", "loadavg_15",
+    "rx_bytes", "tx_bytes", "rx_packets", "tx_packets",
+)
+_FLOATS = 7
+
+def encode(payload: dict) -> bytes:
+    # Agent-shaped dict -> one binary record (mirrors encode_binary() in agent.py)
+    sysm, netm = payload.get("system", {}), payload.get("network", {})
+    load = (list(sysm.get("loadavg") or []) + [None] * 3)[:3]
+    raw = [sysm.get("uptime_s"), sysm.get("cpu_pct"), sysm.get("mem_pct"), sysm.get("disk_pct"), *load,
+           netm.get("rx_bytes"), netm.get("tx_bytes"), netm.get("rx_packets"), netm.get("tx_packets")]
+    flags = 0
+    for i, v in enumerate(raw):
+        if v is not None:
+            flags |= 1 << i
+    nums = [float(v or 0) for v in raw[:_FLOATS]] + [int(v or 0) for v in raw[_FLOATS:]]
+    out = [HEADER.pack(MAGIC, VERSION, flags, int(payload["ts"]), int(payload.get("interval", 0)), *nums)]
+    for text in (payload["device_id"], netm.get("iface"), netm.get("ip"), netm.get("mac")):
+        b = str(text or "").encode()
+        if len(b) > 255:
+            b = b[:255].decode(errors="ignore").encode()
+        out.append(bytes((len(b),)) + b)
+    return b"".join(out)
+
+def decode(data: bytes, default_interval: int) -> tuple:
+    # Binary records -> ([DeviceState], error). Decoding stops at the first bad
+    # record, since its length (and so where the next one starts) is unknown.
+    states, off, end = [], 0, len(data)
+    intern = sys.intern
+    while off < end:
+        if end - off < HEADER.size:
+            return states, "truncated record"
+        magic, version, flags, ts, interval, *nums = HEADER.unpack_from(data, off)
+        if magic != MAGIC or version != VERSION:
+            return states, f"unsupported record (magic={magic!r}, version={version})"
+        off += HEADER.size
+        texts = []
+        for _ in range(4):
+            if off >= end:
+                return states, "truncated record"
+            n = data[off]
+            if off + 1 + n > end:
+                return states, "truncated record"
+            try:
+                texts.append(bytes(data[off + 1:off + 1 + n]).decode())
+            except UnicodeDecodeError:
+                return states, "invalid UTF-8 string"
+            off += 1 + n
+        if not texts[0]:
+            return states, "missing field: device_id"
+        st = DeviceState(intern(texts[0]), ts, interval or default_interval)
+        for i, name in enumerate(NUMERIC_FIELDS):
+            if flags & (1 << i):
+                setattr(st, name, nums[i])
+        st.iface, st.ip, st.mac = intern(texts[1]), intern(texts[2]), intern(texts[3])
+        states.append(st)
+    return states, None